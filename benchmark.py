@@ -0,0 +1,306 @@
+import asyncio
+import datetime
+import os
+import pytz
+import random
+import re
+import send_scheduler
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import tweet_stats
+from types import SimpleNamespace
+from twitter import TwitterScraper, Tweet, User
+from fake_twitter_api import FakeTwitterAPI
+
+# Offline benchmarks for the startup, scraping and delivery hot paths. Run with
+# `python benchmark.py`, or e.g. `python benchmark.py startup e2e` for only some of them
+
+SIZES = [100, 1000, 3200]
+
+# Synthetic tweepy-like tweets, about half of them with 1-4 images attached
+def make_tweets(count):
+    tweets = []
+    media = []
+    for i in range(count):
+        attachments = None
+        if random.random() < 0.5:
+            keys = [f"3_{i}_{n}" for n in range(random.randint(1, 4))]
+            attachments = {"media_keys": keys}
+            media.extend({"media_key": key, "type": "photo", "url": f"https://pbs.twimg.com/{key}.jpg"}
+                         for key in keys)
+        tweets.append(SimpleNamespace(id=i, attachments=attachments))
+    return (tweets, media)
+
+# How media used to be joined to tweets: a scan over all media for each tweet's first key
+def join_media_scan(tweets, user_media):
+    joined = []
+    for tweet in tweets:
+        media = None
+        if (tweet.attachments != None) and ("media_keys" in tweet.attachments):
+            media_key = tweet.attachments["media_keys"][0]
+            media_item = [m for m in user_media if (media_key == m["media_key"])]
+            if len(media_item) > 0:
+                media = media_item[0]
+        joined.append(media)
+    return joined
+
+def join_media_index(scraper, tweets, user_media):
+    media_index = {}
+    scraper.index_media(user_media, media_index)
+    return [scraper.join_media(tweet, media_index) for tweet in tweets]
+
+def report(name, count, seconds, number):
+    print(f"{name:<32} {count:>6} tweets {seconds / number * 1000:>10.3f} ms")
+
+def bench_media_join():
+    print("Media join")
+    scraper = TwitterScraper.get_instance()
+    for count in SIZES:
+        tweets, media = make_tweets(count)
+        number = max(1, 3200 // count)
+        report("before (list scan)", count,
+               timeit.timeit(lambda: join_media_scan(tweets, media), number=number), number)
+        report("after (media_key index)", count,
+               timeit.timeit(lambda: join_media_index(scraper, tweets, media), number=number), number)
+
+# How get_best_tweets used to select: nine statistics calls over lists, then a loop
+def select_statistics(tweets, rt_counts, like_counts, reply_counts):
+    rt_mean, like_mean, reply_mean = (statistics.mean(c) for c in (rt_counts, like_counts, reply_counts))
+    rt_std, like_std, reply_std = (statistics.stdev(c) for c in (rt_counts, like_counts, reply_counts))
+    rt_quant, like_quant, reply_quant = (statistics.quantiles(c, n=10)[6]
+                                         for c in (rt_counts, like_counts, reply_counts))
+    selected = []
+    for tweet in tweets:
+        if (tweet.rt_count > rt_mean + rt_std or tweet.like_count > like_mean + like_std
+                or tweet.reply_count > reply_mean + reply_std or tweet.rt_count >= rt_quant
+                or tweet.like_count >= like_quant or tweet.reply_count >= reply_quant):
+            selected.append(tweet)
+    return selected
+
+def make_user(count):
+    user = User()
+    for i in range(count):
+        user.add_tweet(SimpleNamespace(id=i, rt_count=int(random.paretovariate(1.2)),
+                                       like_count=int(random.paretovariate(1.1) * 10),
+                                       reply_count=int(random.paretovariate(1.5))))
+    return user
+
+def bench_statistics():
+    print("Best tweet selection")
+    for count in SIZES:
+        user = make_user(count)
+        lists = (list(user.rt_counts), list(user.like_counts), list(user.reply_counts))
+        assert select_statistics(user.tweets, *lists) == tweet_stats.select(user)
+        number = max(1, 3200 // count)
+        report("before (statistics module)", count,
+               timeit.timeit(lambda: select_statistics(user.tweets, *lists), number=number), number)
+        report("after (column stats)", count,
+               timeit.timeit(lambda: tweet_stats.select(user), number=number), number)
+
+# How Tweet used to be built: a __dict__ per tweet and every display string up front
+class EagerTweet:
+    def __init__(self, username, tweet, media):
+        self.id = tweet.id
+        self.rt_count = tweet.public_metrics["retweet_count"]
+        self.like_count = tweet.public_metrics["like_count"]
+        self.reply_count = tweet.public_metrics["reply_count"]
+        self.username = username
+        self.timestamp = (tweet.created_at.astimezone(pytz.timezone('America/New_York'))) \
+                         .strftime("%b %d %Y %I:%M:%S %p")
+        self.link = f"https://twitter.com/{self.username}/status/{tweet.id}"
+        self.media_url = media["url"] if (media != None) else None
+        content = tweet.text
+        content = content.replace('\n', ' ')
+        content = content.replace('"', '\\"')
+        self.content = re.sub(r'http\S+', '', content)
+
+def make_raw_tweets(count):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [SimpleNamespace(id=10**18 + i,
+                            public_metrics={"retweet_count": i % 50, "like_count": i % 500, "reply_count": i % 20},
+                            created_at=now - datetime.timedelta(minutes=i),
+                            text=f"Tweet number {i}\nwith a \"quote\" and a link https://t.co/{i:x}",
+                            attachments=None)
+            for i in range(count)]
+
+def build_records(make_record, raw_tweets):
+    return [make_record(raw) for raw in raw_tweets]
+
+def bench_tweet_records():
+    count = 10000
+    print(f"Building {count} tweet records")
+    raw_tweets = make_raw_tweets(count)
+    builders = [("before (eager, __dict__)", lambda raw: EagerTweet("user", raw, None)),
+                ("after (lazy, __slots__)", lambda raw: Tweet("user", raw, []))]
+    for name, make_record in builders:
+        seconds = timeit.timeit(lambda: build_records(make_record, raw_tweets), number=3) / 3
+
+        tracemalloc.start()
+        records = build_records(make_record, raw_tweets)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del records
+
+        print(f"{name:<32} {count / seconds:>10.0f} records/sec {size / count:>8.0f} bytes/record")
+
+# Discord's limits sped up so a 3,200 tweet run takes seconds instead of an hour.
+# The send scheduler's buckets get the same speedup, the fake channel enforces it
+DISCORD_SPEEDUP = 200
+SEND_LATENCY = 0.002 # seconds per simulated Discord request
+
+# Stands in for a Discord channel: answers after SEND_LATENCY, and when sent to
+# faster than the (sped up) rate limit allows, waits it out like discord.py does
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sends = []
+        self.reactions = []
+        self.rate_limited = 0
+        self.next_id = 1
+
+    async def check_limit(self, history, limit, period):
+        now = time.monotonic()
+        while len(history) > 0 and now - history[0] > period:
+            history.pop(0)
+        if len(history) >= limit:
+            self.rate_limited += 1
+            await asyncio.sleep(period - (now - history[0]))
+            return await self.check_limit(history, limit, period)
+        history.append(now)
+
+    async def send(self, embed=None, embeds=None):
+        await asyncio.sleep(SEND_LATENCY)
+        await self.check_limit(self.sends, send_scheduler.MESSAGE_BURST, 5 / DISCORD_SPEEDUP)
+        self.next_id += 1
+        return FakeMessage(self, self.next_id, embeds if embeds is not None else [embed])
+
+class FakeMessage:
+    def __init__(self, channel, message_id, embeds):
+        self.channel = channel
+        self.id = message_id
+        self.embeds = embeds
+
+    async def add_reaction(self, reaction):
+        await asyncio.sleep(SEND_LATENCY)
+        await self.channel.check_limit(self.channel.reactions, send_scheduler.REACTION_BURST, 0.25 / DISCORD_SPEEDUP)
+
+# Longest and total time the event loop didn't get back to a 1ms timer
+async def watch_event_loop(stalls):
+    interval = 0.001
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        stalls.append(time.monotonic() - started - interval)
+
+# /scrape_best from the first Twitter request to the last embed delivered:
+# the real fetch, cache, selection, scheduling and posting code, with a local
+# fake Twitter API and a fake Discord channel at either end
+async def run_scrape_best(bot, api, username, count, channel):
+    bot.client.get_channel = lambda channel_id: channel
+    stalls = []
+    watcher = asyncio.create_task(watch_event_loop(stalls))
+    started = time.monotonic()
+
+    manager = bot.JobManager.get_instance()
+    job = manager.create_job(1, username, count, "best")
+    tweets = await TwitterScraper.get_instance().get_best_tweets_async(username, count)
+    fetched = time.monotonic()
+    await bot.loop_through_messages(tweets=tweets, job=job)
+    manager.finish_job(job)
+
+    elapsed = time.monotonic() - started
+    watcher.cancel()
+    return (elapsed, fetched - started, job.sent, stalls)
+
+async def run_end_to_end(bot, api):
+    for count in SIZES:
+        channel = FakeChannel(1)
+        elapsed, fetch, sent, stalls = await run_scrape_best(bot, api, f"user{count}", count, channel)
+
+        # Separate run for memory since tracemalloc slows everything down. Includes the fake API's allocations
+        tracemalloc.start()
+        await run_scrape_best(bot, api, f"traced{count}", count, FakeChannel(1))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{count:>6} tweets {elapsed:>7.2f} s total {count / fetch:>8.0f} tweets/sec fetched "
+              f"{sent:>5} sent {peak / 2 ** 20:>6.1f} MB peak {max(stalls) * 1000:>6.1f} ms max stall "
+              f"{sum(stall for stall in stalls if stall > 0.01):>5.2f} s stalled {channel.rate_limited:>3} rate limited")
+
+def bench_end_to_end():
+    print(f"End to end /scrape_best (Discord limits sped up {DISCORD_SPEEDUP}x)")
+    # bot builds the Discord client when imported, only this benchmark needs it
+    import bot
+    bot.Database.get_instance().set_scrape_channel(1, 1)
+    send_scheduler.MESSAGE_RATE *= DISCORD_SPEEDUP
+    send_scheduler.REACTION_RATE *= DISCORD_SPEEDUP
+
+    api = FakeTwitterAPI([f"user{count}" for count in SIZES] + [f"traced{count}" for count in SIZES],
+                         timeline_length=max(SIZES)).start()
+    os.environ.setdefault('BEARER_TOKEN', "benchmark")
+    TwitterScraper.get_instance().authorize()
+    api.attach(TwitterScraper.get_instance().client)
+
+    asyncio.run(run_end_to_end(bot, api))
+    api.stop()
+
+STARTUP_RUNS = 5
+REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Parses `python -X importtime` output into the cumulative microseconds of a
+# top level module and the (module, microseconds) of what it imported directly.
+# Nested imports are listed before the module that imported them
+def parse_import_times(output, name):
+    children = []
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if match is None:
+            continue
+
+        depth = len(match.group(2)) // 2
+        if depth == 1:
+            children.append((match.group(3), int(match.group(1))))
+        elif depth == 0:
+            if match.group(3) == name:
+                return (int(match.group(1)), children)
+            children = []
+    return (0, [])
+
+# Time from starting the interpreter until bot.py is imported and ready to call
+# client.run, the part of a restart that's in our hands
+def bench_startup():
+    print("Startup (import bot)")
+    env = dict(os.environ, PYTHONPATH=REPO_DIRECTORY)
+    walls = []
+    imports = []
+    for _ in range(STARTUP_RUNS):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], env=env,
+                                capture_output=True, text=True)
+        walls.append(time.perf_counter() - started)
+        imports.append(parse_import_times(result.stderr, "bot"))
+
+    print(f"{'process wall time (median)':<32} {statistics.median(walls) * 1000:>10.1f} ms")
+    print(f"{'import bot (median)':<32} {statistics.median(total for total, _ in imports) / 1000:>10.1f} ms")
+    _, children = imports[-1]
+    for module, cumulative in sorted(children, key=lambda item: item[1], reverse=True)[:8]:
+        print(f"  {module:<30} {cumulative / 1000:>10.1f} ms")
+
+BENCHMARKS = {
+    "startup": [bench_startup],
+    "micro": [bench_media_join, bench_statistics, bench_tweet_records],
+    "e2e": [bench_end_to_end],
+}
+
+if __name__ == "__main__":
+    random.seed(0)
+    # Logs and the database go to a scratch directory instead of the repo
+    os.chdir(tempfile.mkdtemp())
+    for name in sys.argv[1:] or BENCHMARKS:
+        for benchmark in BENCHMARKS[name]:
+            benchmark()
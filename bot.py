@@ -0,0 +1,526 @@
+import os
+import keep_alive
+import asyncio
+import discord
+import tweet_stats
+from twitter import TwitterScraper, DEFAULT_TIMEZONE, get_timezone
+from logger import Logger
+from discord import app_commands
+from discord_client import create_client
+from database import Database
+from send_scheduler import SendScheduler
+from jobs import JobManager
+from posted_index import PostedIndex
+from message_cache import MessageCache
+from forwarder import Forwarder
+from watcher import Watcher
+from metrics import Metrics
+from embed_cache import EmbedCache
+from media import MediaValidator
+from workers import WorkerPool
+from typing import Optional
+
+intents = discord.Intents.default()
+intents.message_content = True
+client = create_client(intents=intents)
+
+# Loop-owned state exposed on /metrics, sampled from the event loop
+Metrics.get_instance().add_gauge("discord_gateway_latency_seconds", "Discord heartbeat latency",
+                                 lambda: client.latency)
+Metrics.get_instance().add_gauge("bot_embeds_pending", "Embeds waiting in the send scheduler",
+                                 lambda: SendScheduler.get_instance().num_pending())
+Metrics.get_instance().add_gauge("bot_jobs_running", "Scrape jobs running in every guild",
+                                 lambda: len(JobManager.get_instance().jobs))
+
+# On bot connecting to server
+@client.event
+async def on_ready():
+    Logger.get_instance().log(f"@{client.user} connected to Discord")
+    await client.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="twitch.tv/stormy"))
+    Watcher.get_instance().start(post_watched_tweets)
+
+
+# On bot disconnecting from server
+@client.event
+async def on_disconnect():
+    Logger.get_instance().log(f"@{client.user} disconnected from Discord")
+
+# Catch event for a reaction being added to a message
+@client.event
+async def on_raw_reaction_add(payload):
+    if payload.event_type != "REACTION_ADD":
+        return
+
+    # Reaction was not from bot
+    if payload.user_id == client.user.id:
+        return
+
+    # Original message not sent by bot, no need to ask Discord about it
+    cached = MessageCache.get_instance().get_message(payload.message_id)
+    if cached is None:
+        return
+
+    channel_id = Database.get_instance().get_select_channel(payload.guild_id)
+    if channel_id is None:
+        Logger.get_instance().log("Reaction added before /select_channel used", guild_id=payload.guild_id)
+        return
+
+    channel = client.get_channel(channel_id)
+    if channel is None:
+        Logger.get_instance().log(f"Select channel {channel_id} not found", guild_id=payload.guild_id)
+        return
+
+    # Selected tweets are batched up and sent to the Selected channel together.
+    # Only forward each tweet once, however many users react to it
+    tweet_id, embeds, engagement = cached
+    if not Forwarder.get_instance().forward(channel, payload.guild_id, tweet_id, embeds, engagement):
+        Logger.get_instance().log(f"Tweet {tweet_id} was already forwarded")
+        return
+
+    Logger.get_instance().log(f"Queueing embed for channel {channel.id}", tweet_id=tweet_id)
+
+# Wrap a list of tweets so it can be consumed the same way as a streamed scrape
+async def iterate_tweets(tweets):
+    for tweet in tweets:
+        yield tweet
+
+# Reactions can arrive before the job is done, so remember each message as soon as it's sent
+def remember_message(sent, tweet, embeds):
+    if sent.cancelled() or sent.exception() is not None:
+        return
+
+    MessageCache.get_instance().remember(sent.result().id, (tweet.id, embeds, tweet.engagement))
+
+# Hand every embed to the send scheduler, which paces them against Discord's
+# rate limits. Accepts either a list of tweets or an async generator streaming
+# them in as pages arrive from Twitter. Returns how many tweets were sent
+async def loop_through_messages(tweets, job):
+    scheduler = SendScheduler.get_instance()
+    scheduler.reset_stats(job.id)
+    if isinstance(tweets, list):
+        Logger.get_instance().log(f"Iterating through {len(tweets)} tweets")
+        tweets = iterate_tweets(tweets)
+    else:
+        Logger.get_instance().log("Iterating through streamed tweets")
+
+    # Everything that's the same for every tweet of the job is looked up once
+    timezone = Database.get_instance().get_timezone(job.guild_id) or DEFAULT_TIMEZONE
+    channel = client.get_channel(Database.get_instance().get_scrape_channel(job.guild_id))
+    embed_cache = EmbedCache.get_instance()
+    count = 0
+    pending = []
+    queued = []
+    # Embeds are rendered here, ahead of the scheduler which only sends and paces them
+    async for tweet in tweets:
+        if job.is_stopped:
+            Logger.get_instance().log(f"Job {job.id} was stopped")
+            break
+        
+        count += 1
+
+        try:
+            embeds = embed_cache.get_embeds(tweet, timezone)
+            future = scheduler.send(channel, embeds, reaction='👍', tweet_id=tweet.id, job_id=job.id)
+            future.add_done_callback(lambda sent, tweet=tweet, embeds=embeds: remember_message(sent, tweet, embeds))
+            pending.append(future)
+            queued.append((tweet, embeds))
+        except Exception as e:
+            Logger.get_instance().log(f"Encountered error while queueing embed. Error: {e}",
+                                      job_id=job.id, tweet_id=tweet.id)
+
+    posted = {} # channel id -> [(tweet id, message id)]
+    messages = []
+    results = await asyncio.gather(*pending, return_exceptions=True)
+    for (tweet, embeds), result in zip(queued, results):
+        if isinstance(result, BaseException):
+            if not isinstance(result, asyncio.CancelledError):
+                Logger.get_instance().log(f"Encountered error while sending embed. Error: {result}", job_id=job.id)
+        else:
+            posted.setdefault(result.channel.id, []).append((tweet.id, result.id))
+            messages.append((result.id, tweet.id, embeds, tweet.engagement))
+
+    # Store what's behind each message so reactions don't need to fetch it
+    MessageCache.get_instance().store_messages(messages)
+
+    # Record everything that was posted, one transaction per channel
+    for channel_id, channel_posted in posted.items():
+        PostedIndex.get_instance().add_posted(job.guild_id, channel_id, channel_posted)
+
+    sent = sum(len(channel_posted) for channel_posted in posted.values())
+    Metrics.get_instance().count("tweets_posted", sent)
+    job.found = count
+    job.sent = sent
+
+    Logger.get_instance().log(f"Job {job.id} sent {sent}/{count} embeds at "
+                              f"{scheduler.messages_per_second(job.id):.2f} messages/sec",
+                              job_id=job.id, username=job.username)
+    scheduler.reset_stats(job.id)
+    return sent
+
+# Command to set channel to scrape tweets from
+@client.tree.command(description='Change active channel for bot scrape')
+@app_commands.checks.has_permissions(administrator=True)
+async def scrape_channel(interaction: discord.Interaction):
+    Database.get_instance().set_scrape_channel(interaction.guild_id, interaction.channel_id)
+    await interaction.response.send_message(f'Set intended scrape channel to {interaction.channel.name}')
+
+# Command to set channel to send "selected" tweets to
+@client.tree.command(description='Change active channel for bot selection')
+@app_commands.checks.has_permissions(administrator=True)
+async def select_channel(interaction: discord.Interaction):
+    Database.get_instance().set_select_channel(interaction.guild_id, interaction.channel_id)
+    await interaction.response.send_message(f'Set intended select channel to {interaction.channel.name}')
+
+# Command to set the timezone tweet timestamps are shown in
+@client.tree.command(description='Change the timezone tweet timestamps are shown in')
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    timezone='A timezone name like America/New_York or Europe/London'
+)
+async def display_timezone(interaction: discord.Interaction, timezone: str):
+    try:
+        get_timezone(timezone)
+    # pytz's UnknownTimeZoneError is a KeyError, catching that keeps pytz from loading at startup
+    except KeyError:
+        await interaction.response.send_message(f'Unknown timezone {timezone}')
+        return
+
+    Database.get_instance().set_timezone(interaction.guild_id, timezone)
+    await interaction.response.send_message(f'Set displayed timezone to {timezone}')
+
+# Determine if bot should handle a scrape command
+async def should_continue(interaction: discord.Interaction):
+    channel = Database.get_instance().get_scrape_channel(interaction.guild_id)
+
+    # If scrape channel hasn't been set, don't process it
+    if channel is None:
+        Logger.get_instance().log("Command used before /scrape_channel used")
+        await interaction.edit_original_response(content="Set the channel first")
+        return False
+
+    # If command sent from not the scrape channel, don't process it
+    if channel != interaction.channel_id:
+        Logger.get_instance().log("Was not from scrape channel")
+        await interaction.edit_original_response(content="Wrong channel!")
+        return False
+
+    return True
+
+# Interaction tokens expire after 15 minutes, which a long paced job can outlive
+async def edit_response(interaction, content):
+    try:
+        await interaction.edit_original_response(content=content)
+    except discord.HTTPException as e:
+        Logger.get_instance().log(f"Couldn't update the command response. Error: {e}", guild_id=interaction.guild_id)
+
+# Passes tweets through, then awaits on_fetched(count) once the last one has
+# arrived, while their sends are still queued behind the rate limits
+async def notify_fetched(tweets, on_fetched):
+    count = 0
+    async for tweet in tweets:
+        count += 1
+        yield tweet
+
+    await on_fetched(count)
+
+# Tells the user when Twitter kept failing and only part of the timeline was fetched
+def describe_partial(status):
+    if status.complete:
+        return ""
+    return f" (partial results, Twitter error: {status.errors[-1]})"
+
+# Command to scrape "best" tweets from user
+@client.tree.command(description='Scrape the best tweets of a given user')
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    username='The Twitter handle of the user to scrape',
+    count='The amount of tweets to attempt to scrape',
+    strategy='How to decide which tweets are the best',
+    include_posted='Also post tweets that were already posted in this channel'
+)
+@app_commands.choices(strategy=[app_commands.Choice(name=name, value=name) for name in tweet_stats.STRATEGIES])
+async def scrape_best(interaction: discord.Interaction, username: str, count: int,
+                      strategy: Optional[app_commands.Choice[str]] = None, include_posted: bool = False):
+    Logger.get_instance().log(f"Asked to scrape @{username}'s {count} last tweets")
+    await interaction.response.send_message(f"Attempting to scrape the best of @{username}'s {count} last tweets")
+
+    result = await should_continue(interaction)
+    if not result:
+        return
+    
+    strategy = strategy.value if strategy is not None else "default"
+    manager = JobManager.get_instance()
+    job = manager.create_job(interaction.guild_id, username, count, "best")
+    await interaction.edit_original_response(content=f"Queued {job.describe()}")
+
+    status = job.status
+    try:
+        async with manager.fetch_slots:
+            tweets = await TwitterScraper.get_instance().get_best_tweets_async(username, count, strategy, status)
+        if status.user_missing:
+            await interaction.edit_original_response(content=f"Job {job.id}: Couldn't find @{username}")
+            return
+        if tweets is None:
+            await interaction.edit_original_response(content=f"Job {job.id}: Didn't find enough tweets"
+                                                             f"{describe_partial(status)}")
+            return
+
+        found = len(tweets)
+        if not include_posted:
+            tweets = PostedIndex.get_instance().filter_tweets(tweets, interaction.guild_id, interaction.channel_id)
+        
+        await interaction.edit_original_response(content=f'Job {job.id}: Found {found} tweets from {username}, '
+                                                         f'{found - len(tweets)} already posted.'
+                                                         f'{describe_partial(status)}')
+        tweets = await MediaValidator.get_instance().validate_tweets(tweets)
+        await loop_through_messages(tweets=tweets, job=job)
+    finally:
+        manager.finish_job(job)
+
+# Command to scrape "best" tweets from a list of users, ranked together
+@client.tree.command(description='Scrape the best tweets of several users')
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    usernames='The Twitter handles of the users to scrape, separated by spaces or commas',
+    count='The amount of tweets to attempt to scrape per user',
+    strategy='How to decide which tweets are the best',
+    include_posted='Also post tweets that were already posted in this channel'
+)
+@app_commands.choices(strategy=[app_commands.Choice(name=name, value=name) for name in tweet_stats.STRATEGIES])
+async def scrape_many(interaction: discord.Interaction, usernames: str, count: int,
+                      strategy: Optional[app_commands.Choice[str]] = None, include_posted: bool = False):
+    handles = list(dict.fromkeys(name.lstrip('@') for name in usernames.replace(',', ' ').split()))
+    Logger.get_instance().log(f"Asked to scrape {len(handles)} users' {count} last tweets")
+    await interaction.response.send_message(f"Attempting to scrape the best of {len(handles)} users' {count} last tweets")
+
+    result = await should_continue(interaction)
+    if not result:
+        return
+
+    strategy = strategy.value if strategy is not None else "default"
+    concurrency = int(os.environ.get('SCRAPE_MANY_CONCURRENCY', 4))
+    manager = JobManager.get_instance()
+    job = manager.create_job(interaction.guild_id, ' '.join(handles), count, "best of many")
+    await interaction.edit_original_response(content=f"Queued Job {job.id}: best of {len(handles)} users")
+
+    status = job.status
+    try:
+        result = await TwitterScraper.get_instance().get_best_tweets_many(handles, count, strategy,
+                                                                         concurrency, status, manager.fetch_slots)
+        if result is None:
+            await interaction.edit_original_response(content=f"Job {job.id}: Couldn't look up the users, "
+                                                             f"Twitter error: {status.errors[-1]}")
+            return
+
+        tweets, missing = result
+        found = len(tweets)
+        if not include_posted:
+            tweets = PostedIndex.get_instance().filter_tweets(tweets, interaction.guild_id, interaction.channel_id)
+
+        content = f'Job {job.id}: Found {found} tweets from {len(handles) - len(missing)} users, ' \
+                  f'{found - len(tweets)} already posted.'
+        if len(missing) > 0:
+            content += f" Couldn't find {', '.join('@' + name for name in missing)}"
+        content += describe_partial(status)
+        await interaction.edit_original_response(content=content)
+        tweets = await MediaValidator.get_instance().validate_tweets(tweets)
+        await loop_through_messages(tweets=tweets, job=job)
+    finally:
+        manager.finish_job(job)
+
+# Command to scrape all tweets with images from user
+@client.tree.command(description='Scrape the tweets with images of a given user')
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    username='The Twitter handle of the user to scrape',
+    count='The amount of tweets to attempt to scrape',
+    include_posted='Also post tweets that were already posted in this channel'
+)
+async def scrape_images(interaction: discord.Interaction, username: str, count: int, include_posted: bool = False):
+    Logger.get_instance().log(f"Asked to scrape @{username}'s {count} last tweets with images")
+    await interaction.response.send_message(f"Attempting to scrape @{username}'s {count} last tweets with images")
+    
+    result = await should_continue(interaction)
+    if not result:
+        return
+    
+    manager = JobManager.get_instance()
+    job = manager.create_job(interaction.guild_id, username, count, "images")
+    await interaction.edit_original_response(content=f"Queued {job.describe()}")
+
+    status = job.status
+    try:
+        # No global statistics needed, so tweets go straight from each page to the channel
+        tweets = TwitterScraper.get_instance().stream_tweets_with_images(username, count, status)
+        if not include_posted:
+            tweets = PostedIndex.get_instance().filter_stream(tweets, interaction.guild_id, interaction.channel_id, job)
+        # Tweets whose images don't load are dropped, they'd only post blank embeds
+        tweets = MediaValidator.get_instance().validate_stream(tweets, require_media=True)
+
+        # Reported as soon as fetching is done, sending them can take much longer
+        async def on_fetched(found):
+            if found > 0:
+                await edit_response(interaction, f'Job {job.id}: Found {found} tweets with images from {username}, '
+                                                 f'{job.skipped} already posted, sending them'
+                                                 f'{describe_partial(status)}')
+
+        sent = await loop_through_messages(tweets=notify_fetched(manager.throttle(tweets), on_fetched), job=job)
+        if status.user_missing:
+            content = f"Job {job.id}: Couldn't find @{username}"
+        elif job.is_stopped:
+            content = f"Job {job.id}: Stopped after sending {sent} tweets with images from {username}"
+        elif sent == 0 and job.skipped > 0:
+            content = f"Job {job.id}: Nothing new, all {job.skipped} tweets with images were already posted"
+        elif sent == 0:
+            content = f"Job {job.id}: Didn't find enough tweets"
+        else:
+            content = f'Job {job.id}: Sent {sent} tweets with images from {username}, {job.skipped} already posted'
+        await edit_response(interaction, content + describe_partial(status))
+    finally:
+        manager.finish_job(job)
+
+# Post the tweets a watched account got since the last poll to the guild's scrape channel
+async def post_watched_tweets(guild_id, username, tweets):
+    channel_id = Database.get_instance().get_scrape_channel(guild_id)
+    if channel_id is None:
+        Logger.get_instance().log(f"No scrape channel set in guild {guild_id}, dropping watched tweets")
+        return
+
+    tweets = PostedIndex.get_instance().filter_tweets(tweets, guild_id, channel_id)
+    tweets = await MediaValidator.get_instance().validate_tweets(tweets)
+    if len(tweets) == 0:
+        return
+
+    manager = JobManager.get_instance()
+    job = manager.create_job(guild_id, username, len(tweets), "watch")
+    try:
+        await loop_through_messages(tweets=tweets, job=job)
+    finally:
+        manager.finish_job(job)
+
+watch = app_commands.Group(name='watch', description='Post the best new tweets of followed accounts as they come in')
+
+@watch.command(description='Start watching a user for new tweets')
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    username='The Twitter handle of the user to watch',
+    strategy='How to decide which new tweets are good enough to post'
+)
+@app_commands.choices(strategy=[app_commands.Choice(name=name, value=name) for name in tweet_stats.STRATEGIES])
+async def add(interaction: discord.Interaction, username: str, strategy: Optional[app_commands.Choice[str]] = None):
+    username = username.lstrip('@')
+    Logger.get_instance().log(f"Asked to watch @{username}")
+    await interaction.response.send_message(f"Attempting to watch @{username}")
+
+    result = await should_continue(interaction)
+    if not result:
+        return
+
+    strategy = strategy.value if strategy is not None else "default"
+    if not await Watcher.get_instance().add(interaction.guild_id, username, strategy):
+        await interaction.edit_original_response(content=f"Couldn't find enough tweets from @{username} to watch")
+        return
+
+    await interaction.edit_original_response(content=f"Watching @{username} for new {strategy} tweets")
+
+@watch.command(description='Stop watching a user')
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    username='The Twitter handle of the user to stop watching'
+)
+async def remove(interaction: discord.Interaction, username: str):
+    username = username.lstrip('@')
+    if not Watcher.get_instance().remove(interaction.guild_id, username):
+        await interaction.response.send_message(f"Wasn't watching @{username}")
+        return
+
+    Logger.get_instance().log(f"Stopped watching @{username}")
+    await interaction.response.send_message(f"Stopped watching @{username}")
+
+@watch.command(name='list', description='List the users being watched')
+@app_commands.checks.has_permissions(administrator=True)
+async def list_watches(interaction: discord.Interaction):
+    watches = Watcher.get_instance().get_watches(interaction.guild_id)
+    if len(watches) == 0:
+        await interaction.response.send_message("Not watching anyone")
+        return
+
+    lines = [f"@{username} ({strategy}), polled every {interval / 60:.0f} min, next <t:{int(next_poll_at)}:R>"
+             for _, username, strategy, _, interval, next_poll_at, _ in watches]
+    await interaction.response.send_message("\n".join(lines))
+
+client.tree.add_command(watch)
+
+@client.tree.command(description='Stop the output of the ongoing responses')
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(
+    job_id='The job to stop, leave empty to stop every job'
+)
+async def stop_scrape(interaction: discord.Interaction, job_id: Optional[int] = None):
+    Logger.get_instance().log(f"Asked to stop ongoing command (job {job_id})")
+
+    stopped = JobManager.get_instance().stop_jobs(interaction.guild_id, job_id)
+    if len(stopped) == 0:
+        Logger.get_instance().log("Wasn't busy")
+        await interaction.response.send_message("Not currently scraping, nothing to stop")
+        return
+
+    for job in stopped:
+        SendScheduler.get_instance().cancel_pending(job.id)
+    Logger.get_instance().log(f"Stopped {len(stopped)} jobs successfully")
+    await interaction.response.send_message(f"Stopped jobs {', '.join(str(job.id) for job in stopped)}")
+
+@client.tree.command(description='List the ongoing scrape jobs')
+@app_commands.checks.has_permissions(administrator=True)
+async def list_jobs(interaction: discord.Interaction):
+    jobs = JobManager.get_instance().get_jobs(interaction.guild_id)
+    if len(jobs) == 0:
+        await interaction.response.send_message("No scrape jobs running")
+        return
+
+    scheduler = SendScheduler.get_instance()
+    lines = [f"{job.describe()} ({scheduler.num_pending(job.id)} embeds pending)" for job in jobs]
+    await interaction.response.send_message("\n".join(lines))
+
+@client.tree.command(description='Show the last scrapes run in this server')
+@app_commands.checks.has_permissions(administrator=True)
+async def scrape_history(interaction: discord.Interaction):
+    history = Database.get_instance().get_scrape_history(interaction.guild_id)
+    if len(history) == 0:
+        await interaction.response.send_message("No scrapes yet")
+        return
+
+    lines = []
+    for username, kind, count, found, sent, started_at, finished_at in history:
+        status = f"sent {sent}/{found}" if finished_at is not None else "running"
+        lines.append(f"<t:{int(started_at)}:R> {kind} of @{username}'s {count} last tweets, {status}")
+    await interaction.response.send_message("\n".join(lines))
+
+@client.tree.command(description="test command")
+@app_commands.checks.has_permissions(administrator=True)
+async def test_client(interaction: discord.Interaction):
+    print("Testing client")
+    TwitterScraper.get_instance().test_client()
+
+# Runs the bot until it disconnects, called from main.py
+def run():
+    Logger.get_instance().log("Starting program")
+
+    try:
+        keep_alive.keep_alive()
+        TOKEN = os.environ['DISCORD_TOKEN']
+        client.run(TOKEN)
+    except discord.errors.HTTPException as e:
+        Logger.get_instance().log(f"Exception occured. HTTP Status: {e.status}. Discord Code: {e.code}")
+        Logger.get_instance().flush()
+        os.system('kill 1')
+    except Exception as e:
+        Logger.get_instance().log("Unknown exception occured")
+        Logger.get_instance().log(f"Error: {e}")
+        Logger.get_instance().flush()
+        os.system('kill 1')
+    finally:
+        Logger.get_instance().log("Program wrapping up execution")
+        WorkerPool.get_instance().shutdown()
+        Logger.get_instance().shutdown()
+    
\ No newline at end of file
@@ -1,48 +1,262 @@
+import dbm
+import json
+import os
+import pickle
 import shelve
+import sqlite3
+import threading
+import time
+from logger import Logger
 
+# SQLite store shared by the Discord loop, executor threads and the Flask thread.
+# Each thread gets its own connection and WAL mode lets readers run alongside a writer
 class Database:
     __instance = None
-    __database_name = "twitter_users"
-    __shelf = None
+    __database_name = "twitter_users.sqlite3"
+    __shelf_name = "twitter_users"
     __scrape_channel_key = "SCRAPE_CHANNEL"
     __selected_channel_key = "SELECT_CHANNEL"
-    
+    __timezone_key = "TIMEZONE"
+    __migrated_key = "MIGRATED_SHELF"
+    # Settings stored before they were per guild
+    __default_guild = 0
+
+    __schema = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (guild_id, name)
+        );
+        CREATE TABLE IF NOT EXISTS scrape_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            found INTEGER,
+            sent INTEGER,
+            started_at REAL NOT NULL,
+            finished_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS posted_tweets (
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            tweet_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            posted_at REAL NOT NULL,
+            PRIMARY KEY (guild_id, channel_id, tweet_id)
+        );
+        CREATE TABLE IF NOT EXISTS message_embeds (
+            message_id INTEGER PRIMARY KEY,
+            tweet_id INTEGER NOT NULL,
+            embeds TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS forwarded_tweets (
+            guild_id INTEGER NOT NULL,
+            tweet_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, tweet_id)
+        );
+        CREATE TABLE IF NOT EXISTS watched_accounts (
+            guild_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            strategy TEXT NOT NULL,
+            since_id INTEGER,
+            interval REAL NOT NULL,
+            next_poll_at REAL NOT NULL,
+            baseline TEXT NOT NULL,
+            PRIMARY KEY (guild_id, username)
+        );
+    """
+
     # Create Singleton instance of Database
     def __init__(self):
         if Database.__instance != None:
             print("Tried to recreate instance")
         else:
             Database.__instance = self
-            Database.__instance.__shelf = shelve.open(Database.__database_name)
-        
+            self.local = threading.local()
+            self.connection().executescript(Database.__schema)
+            self.migrate_schema()
+            self.migrate_shelf()
+
     def get_instance():
         if Database.__instance is None:
             Database()
         return Database.__instance
-    
+
+    def connection(self):
+        if not hasattr(self.local, "connection"):
+            connection = sqlite3.connect(self.__database_name, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return self.local.connection
+
+    # Columns added after their table was first created
+    def migrate_schema(self):
+        columns = [row[1] for row in self.connection().execute("PRAGMA table_info(message_embeds)")]
+        if "engagement" not in columns:
+            self.connection().execute("ALTER TABLE message_embeds ADD COLUMN engagement INTEGER NOT NULL DEFAULT 0")
+
+    # Copy everything from the old shelve file, once
+    def migrate_shelf(self):
+        if self.get_entry(self.__migrated_key) or not dbm.whichdb(self.__shelf_name):
+            return
+
+        Logger.get_instance().log("Migrating shelf database to SQLite")
+        guild_id = int(os.environ.get('GUILD', self.__default_guild))
+        with shelve.open(self.__shelf_name, flag='r') as shelf:
+            for key in shelf:
+                value = shelf[key]
+                if key == self.__scrape_channel_key:
+                    self.set_scrape_channel(guild_id, value)
+                elif key == self.__selected_channel_key:
+                    self.set_select_channel(guild_id, value)
+                elif key.startswith(self.__timezone_key + ":"):
+                    self.set_timezone(int(key.split(":", 1)[1]), value)
+                else:
+                    self.add_or_update_entry(key, value)
+
+        self.add_or_update_entry(self.__migrated_key, True)
+        Logger.get_instance().log("Finished migrating shelf database")
+
     def add_or_update_entry(self, username, entry):
-        self.__shelf[username] = entry
-        self.__shelf.sync()
-        
+        self.connection().execute("INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)",
+                                  (username, pickle.dumps(entry)))
+
     def get_entry(self, username):
-        if username in self.__shelf:
-            return self.__shelf[username]
+        row = self.connection().execute("SELECT value FROM entries WHERE key = ?", (username,)).fetchone()
+        if row is not None:
+            return pickle.loads(row[0])
         else:
             return None
-    
+
     def remove_entry(self, username):
-        if username in self.__shelf:
-            del self.__shelf[username]
-            self.__shelf.sync()
+        self.connection().execute("DELETE FROM entries WHERE key = ?", (username,))
+
+    def get_setting(self, guild_id, name):
+        row = self.connection().execute("SELECT value FROM guild_settings WHERE guild_id = ? AND name = ?",
+                                        (guild_id, name)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_setting(self, guild_id, name, value):
+        self.connection().execute("INSERT OR REPLACE INTO guild_settings (guild_id, name, value) VALUES (?, ?, ?)",
+                                  (guild_id, name, value))
+
+    # Channels set before settings were per guild still apply to every guild
+    def get_channel_setting(self, guild_id, name):
+        channel = self.get_setting(guild_id, name)
+        if channel is None:
+            channel = self.get_setting(self.__default_guild, name)
+        return int(channel) if channel is not None else None
+
+    def get_scrape_channel(self, guild_id):
+        return self.get_channel_setting(guild_id, self.__scrape_channel_key)
 
-    def get_scrape_channel(self):
-        return self.get_entry(self.__scrape_channel_key)
+    def set_scrape_channel(self, guild_id, channel):
+        self.set_setting(guild_id, self.__scrape_channel_key, str(channel))
 
-    def set_scrape_channel(self, channel):
-        self.add_or_update_entry(self.__scrape_channel_key, channel)
+    def get_select_channel(self, guild_id):
+        return self.get_channel_setting(guild_id, self.__selected_channel_key)
 
-    def get_select_channel(self):
-        return self.get_entry(self.__selected_channel_key)
+    def set_select_channel(self, guild_id, channel):
+        self.set_setting(guild_id, self.__selected_channel_key, str(channel))
 
-    def set_select_channel(self, channel):
-        self.add_or_update_entry(self.__selected_channel_key, channel)
+    def get_timezone(self, guild_id):
+        return self.get_setting(guild_id, self.__timezone_key)
+
+    def set_timezone(self, guild_id, timezone):
+        self.set_setting(guild_id, self.__timezone_key, timezone)
+
+    # Returns the id of the new history row
+    def start_scrape(self, guild_id, username, kind, count):
+        cursor = self.connection().execute(
+            "INSERT INTO scrape_history (guild_id, username, kind, count, started_at) VALUES (?, ?, ?, ?, ?)",
+            (guild_id, username, kind, count, time.time()))
+        return cursor.lastrowid
+
+    def finish_scrape(self, scrape_id, found, sent):
+        self.connection().execute("UPDATE scrape_history SET found = ?, sent = ?, finished_at = ? WHERE id = ?",
+                                  (found, sent, time.time(), scrape_id))
+
+    def get_scrape_history(self, guild_id, limit=10):
+        return self.connection().execute(
+            "SELECT username, kind, count, found, sent, started_at, finished_at FROM scrape_history "
+            "WHERE guild_id = ? ORDER BY id DESC LIMIT ?", (guild_id, limit)).fetchall()
+
+    # posted is a list of (tweet_id, message_id), all written in one transaction
+    def add_posted_tweets(self, guild_id, channel_id, posted):
+        now = time.time()
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO posted_tweets (guild_id, channel_id, tweet_id, message_id, posted_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(guild_id, channel_id, tweet_id, message_id, now) for tweet_id, message_id in posted])
+
+    def get_posted_tweets(self, guild_id, channel_id):
+        rows = self.connection().execute("SELECT tweet_id FROM posted_tweets WHERE guild_id = ? AND channel_id = ?",
+                                         (guild_id, channel_id))
+        return [row[0] for row in rows]
+
+    # messages is a list of (message_id, tweet_id, embed dicts, engagement), all written in one transaction
+    def add_message_embeds(self, messages):
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO message_embeds (message_id, tweet_id, embeds, engagement) VALUES (?, ?, ?, ?)",
+                [(message_id, tweet_id, json.dumps(embeds), engagement)
+                 for message_id, tweet_id, embeds, engagement in messages])
+
+    # Returns (tweet_id, embed dicts, engagement) or None if the bot didn't post the message
+    def get_message_embeds(self, message_id):
+        row = self.connection().execute("SELECT tweet_id, embeds, engagement FROM message_embeds WHERE message_id = ?",
+                                        (message_id,)).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row is not None else None
+
+    def is_forwarded_tweet(self, guild_id, tweet_id):
+        row = self.connection().execute("SELECT 1 FROM forwarded_tweets WHERE guild_id = ? AND tweet_id = ?",
+                                        (guild_id, tweet_id)).fetchone()
+        return row is not None
+
+    # Returns False if the tweet was already forwarded in the guild
+    def add_forwarded_tweet(self, guild_id, tweet_id):
+        cursor = self.connection().execute("INSERT OR IGNORE INTO forwarded_tweets (guild_id, tweet_id) VALUES (?, ?)",
+                                           (guild_id, tweet_id))
+        return cursor.rowcount > 0
+
+    # baseline is a dict of metric name -> list of counts from the account's recent tweets
+    def add_watch(self, guild_id, username, strategy, since_id, interval, next_poll_at, baseline):
+        self.connection().execute(
+            "INSERT OR REPLACE INTO watched_accounts (guild_id, username, strategy, since_id, interval, next_poll_at, "
+            "baseline) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (guild_id, username.lower(), strategy, since_id, interval, next_poll_at, json.dumps(baseline)))
+
+    # Returns False if the account wasn't watched in the guild
+    def remove_watch(self, guild_id, username):
+        cursor = self.connection().execute("DELETE FROM watched_accounts WHERE guild_id = ? AND username = ?",
+                                           (guild_id, username.lower()))
+        return cursor.rowcount > 0
+
+    def update_watch(self, guild_id, username, since_id, interval, next_poll_at, baseline):
+        self.connection().execute(
+            "UPDATE watched_accounts SET since_id = ?, interval = ?, next_poll_at = ?, baseline = ? "
+            "WHERE guild_id = ? AND username = ?",
+            (since_id, interval, next_poll_at, json.dumps(baseline), guild_id, username.lower()))
+
+    # Returns (guild_id, username, strategy, since_id, interval, next_poll_at, baseline) rows,
+    # of one guild or of every guild if no id is given
+    def get_watches(self, guild_id=None):
+        query = "SELECT guild_id, username, strategy, since_id, interval, next_poll_at, baseline FROM watched_accounts"
+        if guild_id is None:
+            rows = self.connection().execute(query + " ORDER BY next_poll_at")
+        else:
+            rows = self.connection().execute(query + " WHERE guild_id = ? ORDER BY next_poll_at", (guild_id,))
+        return [row[:6] + (json.loads(row[6]),) for row in rows]
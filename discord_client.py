@@ -1,16 +1,57 @@
 import discord
+import hashlib
+import json
 import os
+from database import Database
 from logger import Logger
+from metrics import Metrics
 from discord import app_commands
 
-class DiscordClient(discord.Client):
-    def __init__(self, *, intents: discord.Intents):
-        super().__init__(intents=intents)
+# Shared by the plain and the sharded client
+class CommandClient:
+    def __init__(self, *, intents: discord.Intents, **options):
+        super().__init__(intents=intents, **options)
         self.tree = app_commands.CommandTree(self)
 
+    # Commands are registered globally so every guild the bot joins gets them.
+    # Setting GUILD limits them to that one guild instead, where changes show up
+    # immediately while global ones can take a while
     async def setup_hook(self):
         Logger.get_instance().log("Setting up Discord hook")
-        guild = discord.Object(id=os.environ['GUILD'])
-        self.tree.copy_global_to(guild=guild)
-        await self.tree.sync(guild=guild)
-        Logger.get_instance().log("Finished setting up Discord hook")
\ No newline at end of file
+        # Runs before the command sync and the gateway connection, so /healthz is up while the bot starts
+        Metrics.get_instance().start()
+        guild = None
+        if 'GUILD' in os.environ:
+            guild = discord.Object(id=os.environ['GUILD'])
+            self.tree.copy_global_to(guild=guild)
+
+        # Syncing is a slow request, and only needed when the commands changed since the last boot
+        commands = [command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)]
+        digest = hashlib.sha256(json.dumps(commands, sort_keys=True).encode()).hexdigest()
+        key = f"COMMAND_TREE_HASH:{self.application_id}:{guild.id if guild is not None else 'global'}"
+        if Database.get_instance().get_entry(key) == digest:
+            Logger.get_instance().log("Commands unchanged, skipping sync")
+        else:
+            await self.tree.sync(guild=guild)
+            Database.get_instance().add_or_update_entry(key, digest)
+        Logger.get_instance().log("Finished setting up Discord hook")
+
+    async def on_guild_join(self, guild):
+        Logger.get_instance().log(f"Joined guild {guild.name}", guild_id=guild.id)
+
+class DiscordClient(CommandClient, discord.Client):
+    pass
+
+# One gateway connection per shard, for when the bot is in too many guilds for one
+class ShardedDiscordClient(CommandClient, discord.AutoShardedClient):
+    pass
+
+# DISCORD_SHARDED=1 switches to the sharded client, DISCORD_SHARD_COUNT overrides
+# the shard count Discord recommends
+def create_client(intents):
+    if os.environ.get('DISCORD_SHARDED', '0') != '1':
+        return DiscordClient(intents=intents)
+
+    shard_count = os.environ.get('DISCORD_SHARD_COUNT')
+    Logger.get_instance().log(f"Starting sharded client with {shard_count or 'recommended'} shards")
+    return ShardedDiscordClient(intents=intents, shard_count=int(shard_count) if shard_count else None)
@@ -0,0 +1,54 @@
+import discord
+import os
+from collections import OrderedDict
+
+EMBED_COLOR = 0xe67e22
+MAX_GALLERY_IMAGES = 4 # Discord merges embeds sharing a url into one gallery, up to 4 images
+
+# Rendered embeds of recently posted tweets. Keyed by the tweet's metrics and
+# images as well as its id, so a tweet whose numbers changed gets a fresh
+# footer, while reposts and forwards of the same snapshot reuse the embeds as they are
+class EmbedCache:
+    __instance = None
+    __default_size = 2000
+
+    def __init__(self):
+        if EmbedCache.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            EmbedCache.__instance = self
+            self.max_size = int(os.environ.get('EMBED_CACHE_SIZE', EmbedCache.__default_size))
+            self.embeds = OrderedDict() # (tweet id, retweets, likes, replies, images, timezone) -> embeds
+
+    def get_instance():
+        if EmbedCache.__instance is None:
+            EmbedCache()
+        return EmbedCache.__instance
+
+    def render(tweet, timezone):
+        embed_msg = discord.Embed(title=f'Tweet from {tweet.username} at {tweet.get_timestamp(timezone)}',
+                                  url=tweet.link,
+                                  color=EMBED_COLOR,
+                                  description=tweet.content)
+        if tweet.media_url != None:
+            embed_msg.set_image(url=tweet.media_url)
+
+        embed_msg.set_footer(text=f"Users gave this tweet {tweet.rt_count} retweets, "
+                                  f"{tweet.like_count} likes, and {tweet.reply_count} replies.")
+
+        embeds = [embed_msg]
+        for media_url in tweet.media_urls[1:MAX_GALLERY_IMAGES]:
+            embeds.append(discord.Embed(url=tweet.link).set_image(url=media_url))
+        return embeds
+
+    def get_embeds(self, tweet, timezone):
+        key = (tweet.id, tweet.rt_count, tweet.like_count, tweet.reply_count, tweet.media_urls, timezone)
+        if key in self.embeds:
+            self.embeds.move_to_end(key)
+            return self.embeds[key]
+
+        embeds = EmbedCache.render(tweet, timezone)
+        self.embeds[key] = embeds
+        while len(self.embeds) > self.max_size:
+            self.embeds.popitem(last=False)
+        return embeds
@@ -0,0 +1,268 @@
+import datetime
+import json
+import random
+import re
+import requests
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for the parts of the Twitter v2 API the scraper uses, for
+# testing retries and rate limits offline. Point a tweepy client at it with
+# attach(client). Failures are injected with fail_next, e.g. fail_next(503, 2)
+# makes the next two requests fail, fail_next(429, 1, reset_after=5) rate limits one
+
+TWITTER_API = "https://api.twitter.com"
+RATE_LIMIT = 900 # requests per window, like the user timeline endpoint
+RATE_LIMIT_WINDOW = 15 * 60 # seconds
+
+# Synthetic timeline, newest first, with about half the tweets carrying 1-4 images
+def make_timeline(user_id, count):
+    tweets = []
+    media = {}
+    now = time.time()
+    for i in range(count):
+        tweet_id = user_id * 10 ** 6 + count - i
+        tweet = {
+            "id": str(tweet_id),
+            "edit_history_tweet_ids": [str(tweet_id)],
+            "text": f"Tweet {tweet_id} https://t.co/{tweet_id}",
+            "created_at": datetime.datetime.fromtimestamp(now - i * 600, datetime.timezone.utc)
+                                  .strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "public_metrics": {
+                "retweet_count": random.randint(0, 500),
+                "like_count": random.randint(0, 5000),
+                "reply_count": random.randint(0, 100),
+                "quote_count": 0,
+            },
+            "possibly_sensitive": False,
+        }
+        if random.random() < 0.2:
+            tweet["referenced_tweets"] = [{"type": "quoted", "id": str(tweet_id - 1)}]
+        if random.random() < 0.5:
+            keys = [f"3_{tweet_id}_{n}" for n in range(random.randint(1, 4))]
+            tweet["attachments"] = {"media_keys": keys}
+            for key in keys:
+                media[key] = {"media_key": key, "type": "photo", "url": f"https://pbs.twimg.com/media/{key}.jpg",
+                              "preview_image_url": f"https://pbs.twimg.com/media/{key}_preview.jpg",
+                              "public_metrics": {"view_count": random.randint(0, 10 ** 5)}}
+        tweets.append(tweet)
+    return (tweets, media)
+
+class FakeTwitterAPI:
+    def __init__(self, users=None, timeline_length=3200, latency=0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.failures = [] # (status, reset_after) for the next requests
+        self.requests = [] # (path, query) of every request served
+        self.remaining = {} # endpoint -> [remaining, reset timestamp]
+        self.users = {}
+        self.timelines = {}
+        self.tweets = {}
+        for user_id, username in enumerate(users or ["test_user"], start=1):
+            self.add_user(user_id, username, timeline_length)
+        self.server = None
+
+    def add_user(self, user_id, username, timeline_length):
+        tweets, media = make_timeline(user_id, timeline_length)
+        self.users[username.lower()] = {
+            "id": str(user_id),
+            "name": username,
+            "username": username,
+            "public_metrics": {"followers_count": random.randint(100, 10 ** 6), "following_count": 0,
+                               "tweet_count": timeline_length, "listed_count": 0},
+        }
+        self.timelines[str(user_id)] = (tweets, media)
+        self.tweets.update((tweet["id"], (tweet, media)) for tweet in tweets)
+
+    # Add count tweets newer than the user's current timeline
+    def post_tweets(self, username, count):
+        user_id = self.users[username.lower()]["id"]
+        tweets, media = self.timelines[user_id]
+        new_tweets, new_media = make_timeline(int(user_id), len(tweets) + count)
+        new_tweets = new_tweets[:count]
+        media.update(new_media)
+        self.timelines[user_id] = (new_tweets + tweets, media)
+        self.tweets.update((tweet["id"], (tweet, media)) for tweet in new_tweets)
+        return new_tweets
+
+    def fail_next(self, status, count=1, reset_after=0):
+        with self.lock:
+            self.failures.extend([(status, reset_after)] * count)
+
+    def start(self, port=0):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                api.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    # Send a tweepy client's requests here instead of to api.twitter.com
+    def attach(self, client):
+        client.session.mount(TWITTER_API, RedirectAdapter(self.url))
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        with self.lock:
+            self.requests.append((url.path, query))
+            failure = self.failures.pop(0) if len(self.failures) > 0 else None
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        endpoint = re.sub(r"^/2/users/by/username/[^/]+", "/2/users/by/username/:username", url.path)
+        endpoint = re.sub(r"^/2/users/\d+", "/2/users/:id", endpoint)
+        headers = self.use_rate_limit(endpoint, failure)
+
+        if failure is not None:
+            status, _ = failure
+            body = {"title": "Injected failure", "detail": f"Injected {status}", "status": status}
+            self.respond(request, status, body, headers)
+            return
+
+        match = re.match(r"^/2/users/by/username/([^/]+)$", url.path)
+        if match is not None:
+            body = self.get_user(match.group(1))
+        elif url.path == "/2/users/by":
+            body = self.get_users(query["usernames"].split(","))
+        elif re.match(r"^/2/users/\d+/tweets$", url.path):
+            body = self.get_user_tweets(url.path.split("/")[3], query)
+        elif url.path == "/2/tweets":
+            body = self.get_tweets(query["ids"].split(","), query)
+        else:
+            self.respond(request, 404, {"title": "Not Found Error", "detail": url.path}, headers)
+            return
+
+        self.respond(request, 200, body, headers)
+
+    def use_rate_limit(self, endpoint, failure):
+        now = time.time()
+        with self.lock:
+            limit = self.remaining.get(endpoint)
+            if limit is None or now >= limit[1]:
+                limit = self.remaining[endpoint] = [RATE_LIMIT, int(now) + RATE_LIMIT_WINDOW]
+            limit[0] = max(limit[0] - 1, 0)
+            reset = limit[1]
+            remaining = limit[0]
+
+        if failure is not None and failure[0] == 429:
+            remaining = 0
+            reset = int(now + failure[1])
+        return {
+            "x-rate-limit-limit": str(RATE_LIMIT),
+            "x-rate-limit-remaining": str(remaining),
+            "x-rate-limit-reset": str(reset),
+        }
+
+    def respond(self, request, status, body, headers):
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def get_user(self, username):
+        user = self.users.get(username.lower())
+        if user is None:
+            return {"errors": [{"title": "Not Found Error", "detail": f"Could not find user: {username}",
+                                "type": "https://api.twitter.com/2/problems/resource-not-found"}]}
+        return {"data": user}
+
+    def get_users(self, usernames):
+        found = [self.users[name.lower()] for name in usernames if name.lower() in self.users]
+        body = {"data": found} if len(found) > 0 else {}
+        errors = [{"value": name, "detail": f"Could not find user: {name}", "title": "Not Found Error",
+                   "type": "https://api.twitter.com/2/problems/resource-not-found"}
+                  for name in usernames if name.lower() not in self.users]
+        if len(errors) > 0:
+            body["errors"] = errors
+        return body
+
+    def get_user_tweets(self, user_id, query):
+        tweets, media = self.timelines.get(user_id, ([], {}))
+        if "since_id" in query:
+            tweets = [tweet for tweet in tweets if int(tweet["id"]) > int(query["since_id"])]
+        if "until_id" in query:
+            tweets = [tweet for tweet in tweets if int(tweet["id"]) < int(query["until_id"])]
+        if "end_time" in query:
+            end_time = datetime.datetime.fromisoformat(query["end_time"])
+            tweets = [tweet for tweet in tweets if datetime.datetime.fromisoformat(tweet["created_at"]) < end_time]
+
+        start = int(query.get("pagination_token", 0))
+        page_size = int(query.get("max_results", 10))
+        page = tweets[start:start + page_size]
+        meta = {"result_count": len(page)}
+        if len(page) > 0:
+            meta["newest_id"] = page[0]["id"]
+            meta["oldest_id"] = page[-1]["id"]
+        if start + page_size < len(tweets):
+            meta["next_token"] = str(start + page_size)
+        return self.make_tweets_body(page, media, query, meta)
+
+    def get_tweets(self, ids, query):
+        found = [self.tweets[tweet_id] for tweet_id in ids if tweet_id in self.tweets]
+        media = {}
+        for _, user_media in found:
+            media.update(user_media)
+        return self.make_tweets_body([tweet for tweet, _ in found], media, query)
+
+    # Like the real API, only the requested fields and expansions are returned
+    def make_tweets_body(self, tweets, media, query, meta=None):
+        tweet_fields = {"id", "text", "edit_history_tweet_ids"} | set(query.get("tweet.fields", "").split(","))
+        media_fields = {"media_key", "type"} | set(query.get("media.fields", "").split(","))
+        expansions = set(query.get("expansions", "").split(","))
+        if "attachments.media_keys" in expansions:
+            tweet_fields.add("attachments")
+        if "referenced_tweets.id" in expansions:
+            tweet_fields.add("referenced_tweets")
+
+        body = {}
+        if len(tweets) > 0:
+            body["data"] = [{name: value for name, value in tweet.items() if name in tweet_fields} for tweet in tweets]
+
+        includes = {}
+        if "attachments.media_keys" in expansions:
+            keys = [key for tweet in tweets for key in tweet.get("attachments", {}).get("media_keys", [])]
+            if len(keys) > 0:
+                includes["media"] = [{name: value for name, value in media[key].items() if name in media_fields}
+                                     for key in keys]
+        if "referenced_tweets.id" in expansions:
+            ids = [ref["id"] for tweet in tweets for ref in tweet.get("referenced_tweets", []) if ref["id"] in self.tweets]
+            if len(ids) > 0:
+                includes["tweets"] = [{name: value for name, value in self.tweets[tweet_id][0].items()
+                                       if name in tweet_fields} for tweet_id in ids]
+        if len(includes) > 0:
+            body["includes"] = includes
+        if meta is not None:
+            body["meta"] = meta
+        return body
+
+# requests adapter that rewrites api.twitter.com URLs to the fake server
+class RedirectAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace(TWITTER_API, self.base_url, 1)
+        return super().send(request, **kwargs)
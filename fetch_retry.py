@@ -0,0 +1,87 @@
+import contextvars
+import random
+import threading
+import time
+from lazy import lazy_import
+from logger import Logger
+
+requests = lazy_import("requests")
+tweepy = lazy_import("tweepy")
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 1 # seconds
+MAX_DELAY = 60 # seconds
+MAX_RATE_LIMIT_WAIT = 15 * 60 # seconds, the length of a Twitter rate limit window
+
+# Errors worth trying again, anything else (bad request, not found...) won't fix itself.
+# A function so tweepy and requests aren't loaded until a request actually fails
+def get_transient_errors():
+    return (tweepy.TwitterServerError, requests.ConnectionError, requests.Timeout)
+
+# Set to the stop event of the scrape whose pages an executor thread is
+# fetching, so its waits for rate limits and retries end when it's stopped
+stop_event = contextvars.ContextVar("stop_event", default=None)
+
+# The scrape was stopped while waiting to send its next request
+class FetchStopped(Exception):
+    pass
+
+# Whether a scrape got everything it asked for, and why not if it didn't
+class FetchStatus:
+    def __init__(self):
+        self.complete = True
+        self.errors = []
+        self.user_missing = False
+        self.stopped = threading.Event()
+
+    def fail(self, error):
+        self.complete = False
+        self.errors.append(str(error))
+
+    def stop(self):
+        self.stopped.set()
+
+def raise_if_stopped():
+    stopped = stop_event.get()
+    if stopped is not None and stopped.is_set():
+        raise FetchStopped("Scrape was stopped")
+
+# Like time.sleep, but raises FetchStopped as soon as the scrape is stopped
+def sleep(seconds):
+    stopped = stop_event.get()
+    if stopped is None:
+        time.sleep(seconds)
+    elif stopped.wait(seconds):
+        raise FetchStopped("Scrape was stopped")
+
+# Full jitter keeps concurrent scrapes from retrying in lockstep
+def get_backoff(attempt):
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+def get_rate_limit_wait(error):
+    reset = error.response.headers.get("x-rate-limit-reset")
+    if reset is None:
+        return None
+    return min(max(int(reset) - time.time() + 1, 0), MAX_RATE_LIMIT_WAIT)
+
+# Runs call(), retrying transient errors with jittered exponential backoff and
+# waiting out 429s until the rate limit resets. Runs in executor threads, so
+# sleeping here never blocks the event loop, and stopping the job ends the wait
+def call_with_retries(call, description):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return call()
+        except tweepy.TooManyRequests as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            wait = get_rate_limit_wait(e)
+            if wait is None:
+                wait = get_backoff(attempt)
+            Logger.get_instance().log(f"Rate limited while fetching {description}, retrying in {wait:.1f}s")
+            sleep(wait)
+        except get_transient_errors() as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            wait = get_backoff(attempt)
+            Logger.get_instance().log(f"Error while fetching {description}, retrying in {wait:.1f}s. Error: {e}")
+            sleep(wait)
@@ -0,0 +1,51 @@
+import threading
+from logger import Logger
+
+# Bytes, tweets and time spent on timeline pages for each fetch profile, to
+# see what trimming the requested fields saves
+class FetchStats:
+    __instance = None
+
+    def __init__(self):
+        if FetchStats.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            FetchStats.__instance = self
+            self.lock = threading.Lock()
+            self.local = threading.local()
+            self.profiles = {} # profile -> [pages, tweets, bytes, seconds]
+
+    def get_instance():
+        if FetchStats.__instance is None:
+            FetchStats()
+        return FetchStats.__instance
+
+    # requests response hook, registered on the tweepy client's session. The
+    # page is read back on the same thread right after tweepy returns it
+    def record_response(self, response, *args, **kwargs):
+        self.local.last_bytes = len(response.content)
+
+    def take_last_bytes(self):
+        size = getattr(self.local, "last_bytes", 0)
+        self.local.last_bytes = 0
+        return size
+
+    # latency covers the request and tweepy parsing the JSON into objects
+    def add_page(self, profile, tweets, size, latency):
+        with self.lock:
+            stats = self.profiles.setdefault(profile, [0, 0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += tweets
+            stats[2] += size
+            stats[3] += latency
+
+    # profile -> (pages, tweets, bytes, seconds)
+    def get_stats(self):
+        with self.lock:
+            return {profile: tuple(stats) for profile, stats in self.profiles.items()}
+
+    def log_stats(self):
+        for profile, (pages, tweets, size, seconds) in self.get_stats().items():
+            Logger.get_instance().log(f"Fetch profile {profile}: {pages} pages, {tweets} tweets, "
+                                      f"{size / max(tweets, 1):.0f} bytes/tweet, "
+                                      f"{seconds / max(pages, 1) * 1000:.0f} ms/page")
@@ -0,0 +1,95 @@
+import asyncio
+import discord
+import os
+from logger import Logger
+from message_cache import MessageCache
+from send_scheduler import SendScheduler
+
+# Discord allows at most 10 embeds in one message
+MAX_EMBEDS_PER_MESSAGE = 10
+
+# Collects selected tweets for a short window after the first reaction, then
+# forwards them in as few messages as possible, most engaging tweets first
+class Forwarder:
+    __instance = None
+    __default_window = 10 # seconds
+
+    def __init__(self):
+        if Forwarder.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            Forwarder.__instance = self
+            self.window = float(os.environ.get('FORWARD_WINDOW', Forwarder.__default_window))
+            self.pending = {} # channel id -> [(engagement, guild id, tweet id, embeds or embed dicts)]
+            self.channels = {}
+            self.timers = {}
+            # (guild id, tweet id) of tweets queued or being sent. A tweet is only
+            # recorded as forwarded in the Database once its message went out
+            self.forwarding = set()
+
+    def get_instance():
+        if Forwarder.__instance is None:
+            Forwarder()
+        return Forwarder.__instance
+
+    # Returns False if the tweet was already forwarded in the guild, or is waiting to be
+    def forward(self, channel, guild_id, tweet_id, embeds, engagement):
+        key = (guild_id, tweet_id)
+        if key in self.forwarding or MessageCache.get_instance().is_forwarded(guild_id, tweet_id):
+            return False
+
+        self.forwarding.add(key)
+        self.channels[channel.id] = channel
+        self.pending.setdefault(channel.id, []).append((engagement, guild_id, tweet_id, embeds))
+        if channel.id not in self.timers:
+            self.timers[channel.id] = asyncio.create_task(self.flush_later(channel.id))
+        return True
+
+    async def flush_later(self, channel_id):
+        await asyncio.sleep(self.window)
+        del self.timers[channel_id]
+        await self.flush(channel_id)
+
+    # Pack tweets into messages of up to 10 embeds, never splitting one tweet's gallery.
+    # Returns (embeds, (guild id, tweet id) of the tweets in them) for each message
+    def make_batches(self, selected):
+        batches = []
+        batch = []
+        keys = []
+        for _, guild_id, tweet_id, embeds in sorted(selected, key=lambda item: item[0], reverse=True):
+            if len(batch) + len(embeds) > MAX_EMBEDS_PER_MESSAGE:
+                batches.append((batch, keys))
+                batch = []
+                keys = []
+            # Embeds rendered since startup are reused as they are
+            batch.extend(embed if isinstance(embed, discord.Embed) else discord.Embed.from_dict(embed)
+                         for embed in embeds)
+            keys.append((guild_id, tweet_id))
+
+        if len(batch) > 0:
+            batches.append((batch, keys))
+        return batches
+
+    async def flush(self, channel_id):
+        selected = self.pending.pop(channel_id, [])
+        channel = self.channels.pop(channel_id, None)
+        if len(selected) == 0 or channel is None:
+            return
+
+        batches = self.make_batches(selected)
+        Logger.get_instance().log(f"Forwarding {len(selected)} tweets to channel {channel_id} "
+                                  f"in {len(batches)} messages")
+
+        # Goes through the send scheduler so forwards share the rate limit fairly with scrape jobs
+        scheduler = SendScheduler.get_instance()
+        pending = [scheduler.send(channel, batch, job_id="forward") for batch, _ in batches]
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        for (_, keys), result in zip(batches, results):
+            # Tweets of a failed message can be forwarded again by the next reaction
+            self.forwarding.difference_update(keys)
+            if isinstance(result, BaseException):
+                Logger.get_instance().log(f"Encountered error while forwarding embeds. Error: {result}")
+                continue
+
+            for guild_id, tweet_id in keys:
+                MessageCache.get_instance().mark_forwarded(guild_id, tweet_id)
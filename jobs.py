@@ -0,0 +1,79 @@
+import asyncio
+import os
+from database import Database
+from fetch_retry import FetchStatus
+from fetch_stats import FetchStats
+from logger import Logger
+
+class ScrapeJob:
+    def __init__(self, job_id, guild_id, username, count, kind):
+        self.id = job_id
+        self.guild_id = guild_id
+        self.username = username
+        self.count = count
+        self.kind = kind
+        self.is_stopped = False
+        self.status = FetchStatus()
+        self.found = 0
+        self.sent = 0
+        self.skipped = 0 # already posted to the channel
+        self.history_id = None
+
+    def describe(self):
+        return f"Job {self.id}: {self.kind} of @{self.username}'s {self.count} last tweets"
+
+class JobManager:
+    __instance = None
+    __default_max_fetches = 3
+
+    def __init__(self):
+        if JobManager.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            JobManager.__instance = self
+            self.jobs = {}
+            self.next_id = 1
+            max_fetches = int(os.environ.get('MAX_CONCURRENT_SCRAPES', JobManager.__default_max_fetches))
+            self.fetch_slots = asyncio.Semaphore(max_fetches)
+
+    def get_instance():
+        if JobManager.__instance is None:
+            JobManager()
+        return JobManager.__instance
+
+    def create_job(self, guild_id, username, count, kind):
+        job = ScrapeJob(self.next_id, guild_id, username, count, kind)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        job.history_id = Database.get_instance().start_scrape(guild_id, username, kind, count)
+        Logger.get_instance().log(f"Created {job.describe()}")
+        return job
+
+    def finish_job(self, job):
+        self.jobs.pop(job.id, None)
+        Database.get_instance().finish_scrape(job.history_id, job.found, job.sent)
+        Logger.get_instance().log(f"Finished job {job.id}")
+        FetchStats.get_instance().log_stats()
+
+    def get_jobs(self, guild_id):
+        return [job for job in self.jobs.values() if job.guild_id == guild_id]
+
+    # Stop one job, or every job of the guild if no id is given. Returns the stopped jobs
+    def stop_jobs(self, guild_id, job_id=None):
+        stopped = []
+        for job in self.get_jobs(guild_id):
+            if job_id is not None and job.id != job_id:
+                continue
+
+            job.is_stopped = True
+            # Ends any wait for a Twitter rate limit, so the job gives up its fetch slot
+            job.status.stop()
+            stopped.append(job)
+
+        return stopped
+
+    # Hold a fetch slot only while a streamed scrape is still pulling pages
+    async def throttle(self, tweets):
+        async with self.fetch_slots:
+            async for tweet in tweets:
+                yield tweet
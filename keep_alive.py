@@ -1,17 +1,47 @@
-from flask import Flask
 from threading import Thread
 from logger import Logger
+from metrics import Metrics
+from media import THUMBNAIL_DIRECTORY
 
-web = Flask('keep_alive')
+# Flask and waitress are imported on the keep_alive thread, so loading them
+# doesn't hold up connecting to Discord
+def create_app():
+    from flask import Flask, Response, send_from_directory
 
-@web.route('/')
-def home():
-    return "I am alive!"
+    web = Flask('keep_alive')
+
+    @web.route('/')
+    def home():
+        return "I am alive!"
+
+    # Fails once the Discord event loop stops keeping up, so uptime probes restart a wedged bot
+    @web.route('/healthz')
+    def healthz():
+        healthy, reason = Metrics.get_instance().check_health()
+        return Response(reason, status=200 if healthy else 503, mimetype='text/plain')
+
+    @web.route('/metrics')
+    def metrics():
+        return Response(Metrics.get_instance().render(), mimetype='text/plain; version=0.0.4')
+
+    # Downscaled tweet images, made by MediaValidator when MEDIA_THUMBNAILS is on
+    @web.route('/thumbnails/<name>')
+    def thumbnail(name):
+        return send_from_directory(THUMBNAIL_DIRECTORY, name, mimetype='image/jpeg', max_age=24 * 60 * 60)
+
+    return web
 
 def run():
-    Logger.get_instance().log("Starting flask server")
-    web.run(host='0.0.0.0',port=8080)
-    Logger.get_instance().log("Finished starting flask server")
+    web = create_app()
+    try:
+        import waitress
+    except ImportError:
+        Logger.get_instance().log("waitress isn't installed, starting Flask development server")
+        web.run(host='0.0.0.0',port=8080)
+        return
+
+    Logger.get_instance().log("Starting waitress server")
+    waitress.serve(web, host='0.0.0.0', port=8080, threads=4)
 
 def keep_alive():
     Logger.get_instance().log("Starting Flask thread")
@@ -0,0 +1,22 @@
+import importlib.util
+import sys
+import threading
+
+lock = threading.Lock()
+
+# Returns a module that's only actually imported the first time one of its
+# attributes is used, keeping heavy libraries off the startup path
+def lazy_import(name):
+    with lock:
+        if name in sys.modules:
+            return sys.modules[name]
+
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            return None
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loader.exec_module(module)
+        return module
@@ -1,24 +1,107 @@
+import json
+import os
+import queue
+import threading
 import time
 
+# Log records are handed to a background thread that writes them in batches,
+# so logging on the event loop never touches the disk
 class Logger:
     __instance = None
     __file_name = "logs.txt"
+    __max_bytes = 5 * 1024 * 1024
+    __backup_count = 3
+    __batch_size = 500
 
     def __init__(self):
         if Logger.__instance != None:
             print("Tried to recreate instance")
         else:
             Logger.__instance = self
-        
+            self.json_lines = os.environ.get('LOG_FORMAT', 'text') == 'json'
+            self.records = queue.SimpleQueue()
+            self.size = os.path.getsize(self.__file_name) if os.path.exists(self.__file_name) else 0
+            self.writer = threading.Thread(target=self.run, name="logger", daemon=True)
+            self.writer.start()
+
     def get_instance():
         if Logger.__instance is None:
             Logger()
         return Logger.__instance
 
-    def log(self, msg):
-        log_file = open(self.__file_name, "a")
-        timestamp = time.localtime()
-        current_time = time.strftime("[%d/%m/%Y %H:%M:%S]", timestamp)
-        new_msg = current_time + " " + msg + "\n"
-        log_file.write(new_msg)
-        log_file.close()
+    # Extra fields (job_id, username, tweet_id, latency...) are kept as structured data
+    def log(self, msg, **fields):
+        self.records.put((time.time(), msg, fields))
+
+    # Block until everything logged so far is on disk
+    def flush(self):
+        if not self.writer.is_alive():
+            return
+        done = threading.Event()
+        self.records.put(done)
+        done.wait(timeout=5)
+
+    def shutdown(self):
+        if not self.writer.is_alive():
+            return
+        self.records.put(None)
+        self.writer.join(timeout=5)
+
+    def format(self, record):
+        timestamp, msg, fields = record
+        if self.json_lines:
+            return json.dumps({"time": timestamp, "msg": msg, **fields}, default=str) + "\n"
+
+        current_time = time.strftime("[%d/%m/%Y %H:%M:%S]", time.localtime(timestamp))
+        extras = "".join(f" {key}={value}" for key, value in fields.items())
+        return current_time + " " + msg + extras + "\n"
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.records.get()]
+            while len(batch) < self.__batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            waiting = []
+            for record in batch:
+                if record is None:
+                    running = False
+                elif isinstance(record, threading.Event):
+                    waiting.append(record)
+                else:
+                    lines.append(self.format(record))
+
+            self.write(lines)
+            for done in waiting:
+                done.set()
+
+    def write(self, lines):
+        if len(lines) == 0:
+            return
+
+        data = "".join(lines)
+        try:
+            if self.size + len(data) > self.__max_bytes:
+                self.rotate()
+
+            with open(self.__file_name, "a") as log_file:
+                log_file.write(data)
+            self.size += len(data)
+        except OSError as e:
+            print(f"Failed to write logs. Error: {e}")
+
+    # logs.txt -> logs.txt.1 -> logs.txt.2 ...
+    def rotate(self):
+        for i in range(self.__backup_count - 1, 0, -1):
+            older = f"{self.__file_name}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.__file_name}.{i + 1}")
+
+        if os.path.exists(self.__file_name):
+            os.replace(self.__file_name, f"{self.__file_name}.1")
+        self.size = 0
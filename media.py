@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from lazy import lazy_import
+from logger import Logger
+
+requests = lazy_import("requests")
+# Optional, None if Pillow isn't installed
+Image = lazy_import("PIL.Image") if lazy_import("PIL") is not None else None
+
+THUMBNAIL_DIRECTORY = "thumbnails"
+THUMBNAIL_SIZE = (640, 640)
+CHECK_TIMEOUT = 5 # seconds
+CHECK_TTL = 60 * 60 # seconds a reachability check is trusted for
+
+# Checks that tweet images can actually be loaded before their embeds are
+# queued, so a dead link doesn't render as a blank embed and waste a send.
+# HEAD requests go through one pooled session on a small thread pool, and
+# results are kept in a bounded cache since reruns see the same urls.
+# Optionally images are downscaled into a disk cache that keep_alive serves
+class MediaValidator:
+    __instance = None
+    __default_workers = 8
+    __default_cache_size = 5000
+    __default_max_thumbnails = 2000
+    __window = 32 # streamed tweets checked ahead of the one being yielded
+
+    def __init__(self):
+        if MediaValidator.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            MediaValidator.__instance = self
+            workers = int(os.environ.get('MEDIA_CHECK_WORKERS', MediaValidator.__default_workers))
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.cache_size = int(os.environ.get('MEDIA_CHECK_CACHE_SIZE', MediaValidator.__default_cache_size))
+            self.checked = OrderedDict() # url -> (reachable, checked at)
+            # Thumbnails are only made when keep_alive's public address is known and Pillow is installed
+            self.public_url = os.environ.get('PUBLIC_URL')
+            self.make_thumbnails = Image is not None and self.public_url is not None \
+                and os.environ.get('MEDIA_THUMBNAILS', '0') == '1'
+            self.max_thumbnails = int(os.environ.get('MEDIA_MAX_THUMBNAILS', MediaValidator.__default_max_thumbnails))
+            if self.make_thumbnails:
+                os.makedirs(THUMBNAIL_DIRECTORY, exist_ok=True)
+
+    def get_instance():
+        if MediaValidator.__instance is None:
+            MediaValidator()
+        return MediaValidator.__instance
+
+    def is_reachable(self, url):
+        try:
+            response = self.session.head(url, timeout=CHECK_TIMEOUT, allow_redirects=True)
+        except requests.RequestException as e:
+            Logger.get_instance().log(f"Media check failed for {url}. Error: {e}")
+            return False
+
+        content_type = response.headers.get("Content-Type", "")
+        if response.status_code != 200 or not content_type.startswith("image/"):
+            Logger.get_instance().log(f"Media check failed for {url}", status=response.status_code,
+                                      content_type=content_type)
+            return False
+        return True
+
+    def get_thumbnail_name(self, url):
+        return hashlib.sha1(url.encode()).hexdigest() + ".jpg"
+
+    # Returns the url the thumbnail is served at, or None if it couldn't be made
+    def make_thumbnail(self, url):
+        name = self.get_thumbnail_name(url)
+        path = os.path.join(THUMBNAIL_DIRECTORY, name)
+        if not os.path.exists(path):
+            try:
+                response = self.session.get(url, timeout=CHECK_TIMEOUT, stream=True)
+                response.raise_for_status()
+                with Image.open(response.raw) as image:
+                    image.thumbnail(THUMBNAIL_SIZE)
+                    image.convert("RGB").save(path, "JPEG", quality=85)
+            except Exception as e:
+                Logger.get_instance().log(f"Failed to make thumbnail of {url}. Error: {e}")
+                return None
+            self.evict_thumbnails()
+
+        return f"{self.public_url.rstrip('/')}/thumbnails/{name}"
+
+    # Drop the oldest thumbnails past the limit
+    def evict_thumbnails(self):
+        names = os.listdir(THUMBNAIL_DIRECTORY)
+        if len(names) <= self.max_thumbnails:
+            return
+
+        paths = sorted((os.path.join(THUMBNAIL_DIRECTORY, name) for name in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_thumbnails]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Returns the url to embed, or None if the image can't be loaded. Runs on the thread pool
+    def check_url(self, url):
+        if self.make_thumbnails:
+            # Downloading the image for the thumbnail checks it too
+            return self.make_thumbnail(url)
+        return url if self.is_reachable(url) else None
+
+    async def resolve(self, url):
+        entry = self.checked.get(url)
+        if entry is not None and time.time() - entry[1] < CHECK_TTL:
+            self.checked.move_to_end(url)
+            return entry[0]
+
+        loop = asyncio.get_running_loop()
+        resolved = await loop.run_in_executor(self.executor, self.check_url, url)
+        self.checked[url] = (resolved, time.time())
+        self.checked.move_to_end(url)
+        while len(self.checked) > self.cache_size:
+            self.checked.popitem(last=False)
+        return resolved
+
+    # Replaces the tweet's images with the ones that load. Returns False if the
+    # tweet had images and none of them do
+    async def validate_tweet(self, tweet):
+        if len(tweet.media_urls) == 0:
+            return True
+
+        resolved = await asyncio.gather(*(self.resolve(url) for url in tweet.media_urls))
+        tweet.media_urls = tuple(url for url in resolved if url is not None)
+        return len(tweet.media_urls) > 0
+
+    # Tweets whose images are all broken are dropped if require_media is set,
+    # otherwise they're kept as text only
+    async def validate_tweets(self, tweets, require_media=False):
+        valid = await asyncio.gather(*(self.validate_tweet(tweet) for tweet in tweets))
+        kept = [tweet for tweet, is_valid in zip(tweets, valid) if is_valid or not require_media]
+        Logger.get_instance().log(f"Validated media of {len(tweets)} tweets, dropped {len(tweets) - len(kept)}")
+        return kept
+
+    # Streaming version of validate_tweets, checks the next few tweets while
+    # earlier ones are being sent and keeps them in order
+    async def validate_stream(self, tweets, require_media=False):
+        pending = deque()
+        async for tweet in tweets:
+            pending.append((tweet, asyncio.ensure_future(self.validate_tweet(tweet))))
+            if len(pending) < MediaValidator.__window:
+                continue
+
+            tweet, is_valid = pending.popleft()
+            if await is_valid or not require_media:
+                yield tweet
+
+        while len(pending) > 0:
+            tweet, is_valid = pending.popleft()
+            if await is_valid or not require_media:
+                yield tweet
@@ -0,0 +1,56 @@
+import os
+from collections import OrderedDict
+from database import Database
+
+# Remembers which tweet and embeds are behind each message the bot posted, so
+# reactions can be handled without fetching the message from Discord.
+# Recent messages are kept in memory, older ones are looked up in the Database
+class MessageCache:
+    __instance = None
+    __default_size = 5000
+
+    def __init__(self):
+        if MessageCache.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            MessageCache.__instance = self
+            self.max_size = int(os.environ.get('MESSAGE_CACHE_SIZE', MessageCache.__default_size))
+            # message id -> (tweet id, embeds, engagement). Messages sent since startup keep
+            # the rendered discord.Embed objects, ones loaded from the Database have dicts
+            self.messages = OrderedDict()
+
+    def get_instance():
+        if MessageCache.__instance is None:
+            MessageCache()
+        return MessageCache.__instance
+
+    def remember(self, message_id, entry):
+        self.messages[message_id] = entry
+        self.messages.move_to_end(message_id)
+        while len(self.messages) > self.max_size:
+            self.messages.popitem(last=False)
+
+    # Write messages that were remembered as they were sent to the Database, in
+    # one transaction. messages is a list of (message_id, tweet_id, embeds, engagement)
+    def store_messages(self, messages):
+        Database.get_instance().add_message_embeds(
+            [(message_id, tweet_id, [embed.to_dict() for embed in embeds], engagement)
+             for message_id, tweet_id, embeds, engagement in messages])
+
+    # Returns (tweet_id, embeds or embed dicts, engagement), or None if the bot didn't post the message
+    def get_message(self, message_id):
+        if message_id in self.messages:
+            self.messages.move_to_end(message_id)
+            return self.messages[message_id]
+
+        entry = Database.get_instance().get_message_embeds(message_id)
+        if entry is not None:
+            self.remember(message_id, entry)
+        return entry
+
+    def is_forwarded(self, guild_id, tweet_id):
+        return Database.get_instance().is_forwarded_tweet(guild_id, tweet_id)
+
+    # Only called once the tweet was actually delivered. Returns True only the first time
+    def mark_forwarded(self, guild_id, tweet_id):
+        return Database.get_instance().add_forwarded_tweet(guild_id, tweet_id)
@@ -0,0 +1,158 @@
+import asyncio
+import bisect
+import math
+import os
+import threading
+import time
+from collections import deque
+from logger import Logger
+from rate_limiter import RateLimiter
+from fetch_stats import FetchStats
+
+# Upper bounds in seconds of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RATE_WINDOW = 60 # seconds the per second rates are averaged over
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+
+# Runtime metrics served as Prometheus text from keep_alive. Hot paths only
+# bump counters and histograms under a lock. Everything owned by the event
+# loop is sampled by a task on the loop once a second, so the web server
+# thread never touches loop state
+class Metrics:
+    __instance = None
+    __default_max_loop_lag = 5 # seconds
+    __sample_interval = 1 # seconds
+
+    def __init__(self):
+        if Metrics.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            Metrics.__instance = self
+            self.max_loop_lag = float(os.environ.get('HEALTH_MAX_LOOP_LAG', Metrics.__default_max_loop_lag))
+            self.lock = threading.Lock()
+            self.counters = {"tweets_fetched": 0, "tweets_posted": 0}
+            self.histograms = {} # stage -> Histogram
+            self.samplers = {} # gauge name -> (description, function called on the event loop)
+            self.gauges = {} # gauge name -> last sampled value
+            self.history = deque(maxlen=RATE_WINDOW // Metrics.__sample_interval + 1) # (time, counters)
+            self.loop_lag = 0.0
+            self.last_sample = None
+            self.sampler = None
+
+    def get_instance():
+        if Metrics.__instance is None:
+            Metrics()
+        return Metrics.__instance
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    # sample is called on the event loop, so it can read loop-owned state safely
+    def add_gauge(self, name, description, sample):
+        self.samplers[name] = (description, sample)
+
+    def start(self):
+        if self.sampler is None or self.sampler.done():
+            self.sampler = asyncio.create_task(self.run())
+
+    async def run(self):
+        interval = Metrics.__sample_interval
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            # How much later than asked the loop got back to this task
+            self.loop_lag = now - started - interval
+
+            gauges = {}
+            for name, (_, sample) in self.samplers.items():
+                try:
+                    gauges[name] = float(sample())
+                except Exception as e:
+                    Logger.get_instance().log(f"Failed to sample {name}. Error: {e}")
+
+            with self.lock:
+                self.gauges = gauges
+                self.history.append((now, dict(self.counters)))
+                self.last_sample = now
+
+    def get_rates(self):
+        with self.lock:
+            if len(self.history) < 2:
+                return {name: 0.0 for name in self.counters}
+            (first_time, first), (last_time, last) = self.history[0], self.history[-1]
+        return {name: (last[name] - first[name]) / (last_time - first_time) for name in last}
+
+    # Returns (healthy, reason). A wedged loop stops sampling altogether, so
+    # the time since the last sample counts as lag too
+    def check_health(self):
+        if self.last_sample is None:
+            return (False, "event loop not started")
+
+        lag = max(self.loop_lag, time.monotonic() - self.last_sample - Metrics.__sample_interval)
+        if lag > self.max_loop_lag:
+            return (False, f"event loop lag {lag:.2f}s")
+        return (True, "ok")
+
+    def render(self):
+        lines = []
+
+        def add(name, kind, description, samples):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        add("bot_event_loop_lag_seconds", "gauge", "How late the event loop ran a 1s timer",
+            [("", self.loop_lag)])
+        with self.lock:
+            gauges = dict(self.gauges)
+            counters = dict(self.counters)
+            histograms = {stage: (list(h.counts), h.sum) for stage, h in self.histograms.items()}
+        for name, value in gauges.items():
+            if not math.isfinite(value):
+                value = "NaN"
+            add(name, "gauge", self.samplers[name][0], [("", value)])
+
+        for name, value in counters.items():
+            add(f"bot_{name}_total", "counter", f"{name.replace('_', ' ').capitalize()} since startup", [("", value)])
+        for name, value in self.get_rates().items():
+            add(f"bot_{name}_per_second", "gauge", f"{name.replace('_', ' ').capitalize()} per second "
+                f"over the last {RATE_WINDOW}s", [("", round(value, 3))])
+
+        limits = RateLimiter.get_instance().get_limits()
+        add("twitter_rate_limit_remaining", "gauge", "Requests left in the endpoint's rate limit window",
+            [(f'{{endpoint="{endpoint}"}}', remaining) for endpoint, (remaining, _) in limits.items()])
+        add("twitter_rate_limit_reset_timestamp", "gauge", "When the endpoint's rate limit window resets",
+            [(f'{{endpoint="{endpoint}"}}', reset) for endpoint, (_, reset) in limits.items()])
+
+        fetches = FetchStats.get_instance().get_stats()
+        add("twitter_fetched_bytes_total", "counter", "Timeline response bytes by fetch profile",
+            [(f'{{profile="{profile}"}}', size) for profile, (_, _, size, _) in fetches.items()])
+
+        samples = []
+        for stage, (counts, total) in histograms.items():
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                samples.append((f'_bucket{{stage="{stage}",le="{bound}"}}', cumulative))
+            samples.append((f'_sum{{stage="{stage}"}}', round(total, 6)))
+            samples.append((f'_count{{stage="{stage}"}}', cumulative))
+        add("bot_stage_latency_seconds", "histogram", "Latency of each scrape and delivery stage", samples)
+
+        return "\n".join(lines) + "\n"
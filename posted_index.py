@@ -0,0 +1,48 @@
+from database import Database
+from logger import Logger
+
+# In-memory view of the posted_tweets table, loaded once per channel, so reruns
+# can skip tweets that were already posted without querying for each one
+class PostedIndex:
+    __instance = None
+
+    def __init__(self):
+        if PostedIndex.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            PostedIndex.__instance = self
+            self.posted = {} # (guild id, channel id) -> set of tweet ids
+
+    def get_instance():
+        if PostedIndex.__instance is None:
+            PostedIndex()
+        return PostedIndex.__instance
+
+    def get_posted(self, guild_id, channel_id):
+        key = (guild_id, channel_id)
+        if key not in self.posted:
+            self.posted[key] = set(Database.get_instance().get_posted_tweets(guild_id, channel_id))
+        return self.posted[key]
+
+    # posted is a list of (tweet_id, message_id)
+    def add_posted(self, guild_id, channel_id, posted):
+        self.get_posted(guild_id, channel_id).update(tweet_id for tweet_id, _ in posted)
+        Database.get_instance().add_posted_tweets(guild_id, channel_id, posted)
+
+    def filter_tweets(self, tweets, guild_id, channel_id):
+        posted = self.get_posted(guild_id, channel_id)
+        new_tweets = [tweet for tweet in tweets if tweet.id not in posted]
+        Logger.get_instance().log(f"Skipping {len(tweets) - len(new_tweets)} already posted tweets")
+        return new_tweets
+
+    # Streaming version of filter_tweets, counts the skipped tweets on the job as it goes
+    async def filter_stream(self, tweets, guild_id, channel_id, job):
+        posted = self.get_posted(guild_id, channel_id)
+        async for tweet in tweets:
+            if tweet.id in posted:
+                job.skipped += 1
+                continue
+
+            yield tweet
+
+        Logger.get_instance().log(f"Skipped {job.skipped} already posted tweets")
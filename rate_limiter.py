@@ -0,0 +1,76 @@
+import re
+import threading
+import time
+from urllib.parse import urlparse
+from logger import Logger
+from fetch_retry import raise_if_stopped
+
+# Twitter v2 endpoints the scraper uses, as reported in rate-limit buckets
+USER_BY_USERNAME = "/2/users/by/username/:username"
+USERS_BY_USERNAMES = "/2/users/by"
+USER_TWEETS = "/2/users/:id/tweets"
+TWEETS = "/2/tweets"
+
+# Tracks the remaining requests of each Twitter endpoint from the
+# x-rate-limit-* response headers, and holds requests back once a window is
+# nearly used up instead of running into a 429
+class RateLimiter:
+    __instance = None
+    __reserve = 1 # Requests left untouched in every window
+    __stop_check_interval = 1 # seconds
+
+    def __init__(self):
+        if RateLimiter.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            RateLimiter.__instance = self
+            self.limits = {} # endpoint -> [remaining, reset timestamp]
+            self.condition = threading.Condition()
+
+    def get_instance():
+        if RateLimiter.__instance is None:
+            RateLimiter()
+        return RateLimiter.__instance
+
+    def get_endpoint(self, path):
+        path = re.sub(r"^/2/users/by/username/[^/]+", USER_BY_USERNAME, path)
+        return re.sub(r"^/2/users/\d+", "/2/users/:id", path)
+
+    # requests response hook, registered on the tweepy client's session
+    def record(self, response, *args, **kwargs):
+        headers = response.headers
+        if "x-rate-limit-remaining" not in headers or "x-rate-limit-reset" not in headers:
+            return
+
+        endpoint = self.get_endpoint(urlparse(response.url).path)
+        with self.condition:
+            self.limits[endpoint] = [int(headers["x-rate-limit-remaining"]), int(headers["x-rate-limit-reset"])]
+            self.condition.notify_all()
+
+    # Blocks until a request to endpoint fits in its rate limit. Called from
+    # executor threads, never from the event loop
+    def acquire(self, endpoint):
+        waiting = False
+        with self.condition:
+            while True:
+                limit = self.limits.get(endpoint)
+                if limit is None or time.time() >= limit[1]:
+                    return
+
+                if limit[0] > self.__reserve:
+                    # Claim the request now so concurrent scrapes don't overshoot
+                    limit[0] -= 1
+                    return
+
+                wait = limit[1] - time.time() + 1
+                if not waiting:
+                    Logger.get_instance().log(f"Waiting {wait:.0f}s for the {endpoint} rate limit to reset")
+                    waiting = True
+                # Woken up every second or so to notice the scrape being stopped
+                self.condition.wait(timeout=min(wait, self.__stop_check_interval))
+                raise_if_stopped()
+
+    # Remaining requests and reset time of each endpoint seen so far
+    def get_limits(self):
+        with self.condition:
+            return {endpoint: tuple(limit) for endpoint, limit in self.limits.items()}
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from collections import deque
+import discord
+from logger import Logger
+from metrics import Metrics
+
+# Discord's documented per-channel limits. discord.py keeps the real bucket
+# state internally and sleeps out any 429 it hits itself, so these pace sends
+# to stay under the limits, and a bucket is only paused when discord.py gives
+# up retrying and the 429 reaches us
+MESSAGE_RATE = 5 / 5 # 5 messages every 5 seconds
+MESSAGE_BURST = 5
+REACTION_RATE = 1 / 0.25 # 1 reaction every 0.25 seconds
+REACTION_BURST = 1
+MAX_ATTEMPTS = 3
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # Discord told us we're over the limit, empty the bucket until it resets
+    def pause(self, retry_after):
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.blocked_until = max(self.blocked_until, self.updated + retry_after)
+
+# Pending sends of one channel, with their own worker so waiting on this
+# channel's buckets never holds up sends to any other channel
+class ChannelQueue:
+    def __init__(self):
+        self.queues = {} # job id -> pending sends for that job
+        self.order = deque() # round robin of job ids with pending sends
+        self.worker = None
+
+class SendScheduler:
+    __instance = None
+
+    def __init__(self):
+        if SendScheduler.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            SendScheduler.__instance = self
+            self.channels = {} # channel id -> ChannelQueue, only while it has sends pending
+            self.buckets = {}
+            self.stats = {} # job id -> [sent, started]
+
+    def get_instance():
+        if SendScheduler.__instance is None:
+            SendScheduler()
+        return SendScheduler.__instance
+
+    def get_bucket(self, channel_id, route):
+        key = (channel_id, route)
+        if key not in self.buckets:
+            if route == "reaction":
+                self.buckets[key] = TokenBucket(REACTION_RATE, REACTION_BURST)
+            else:
+                self.buckets[key] = TokenBucket(MESSAGE_RATE, MESSAGE_BURST)
+        return self.buckets[key]
+
+    # Queue an embed (or list of embeds) to be sent, returns a future resolving to the sent message
+    def send(self, channel, embed, reaction=None, tweet_id=None, job_id=None):
+        if job_id not in self.stats:
+            self.stats[job_id] = [0, time.monotonic()]
+
+        channel_queue = self.channels.get(channel.id)
+        if channel_queue is None:
+            channel_queue = self.channels[channel.id] = ChannelQueue()
+            channel_queue.worker = asyncio.create_task(self.run(channel.id, channel_queue))
+
+        future = asyncio.get_running_loop().create_future()
+        if job_id not in channel_queue.queues:
+            channel_queue.queues[job_id] = deque()
+            channel_queue.order.append(job_id)
+        channel_queue.queues[job_id].append((channel, embed, reaction, tweet_id, future))
+        return future
+
+    # Drop everything that hasn't been sent yet, either for one job or all of them
+    def cancel_pending(self, job_id=None):
+        cancelled = 0
+        for channel_queue in self.channels.values():
+            job_ids = list(channel_queue.queues) if job_id is None else [job_id]
+            for key in job_ids:
+                queue = channel_queue.queues.pop(key, None)
+                if queue is None:
+                    continue
+
+                channel_queue.order.remove(key)
+                for item in queue:
+                    if item[4].cancel():
+                        cancelled += 1
+
+        Logger.get_instance().log(f"Cancelled {cancelled} pending sends")
+        return cancelled
+
+    def num_pending(self, job_id=None):
+        if job_id is None:
+            return sum(len(queue) for channel_queue in self.channels.values()
+                       for queue in channel_queue.queues.values())
+        return sum(len(channel_queue.queues.get(job_id, ())) for channel_queue in self.channels.values())
+
+    def messages_per_second(self, job_id=None):
+        if job_id not in self.stats:
+            return 0
+
+        sent, started = self.stats[job_id]
+        if sent == 0:
+            return 0
+        return sent / (time.monotonic() - started)
+
+    def reset_stats(self, job_id=None):
+        self.stats.pop(job_id, None)
+
+    def fail(self, future, error):
+        if not future.done():
+            future.set_exception(error)
+
+    # Take one send from each of the channel's jobs in turn so concurrent jobs
+    # share it fairly. The worker exits once the channel has nothing left to send
+    async def run(self, channel_id, channel_queue):
+        while len(channel_queue.order) > 0:
+            job_id = channel_queue.order.popleft()
+            queue = channel_queue.queues[job_id]
+            item = queue.popleft()
+            if len(queue) > 0:
+                channel_queue.order.append(job_id)
+            else:
+                del channel_queue.queues[job_id]
+
+            await self.deliver(job_id, *item)
+
+        del self.channels[channel_id]
+
+    async def deliver(self, job_id, channel, embed, reaction, tweet_id, future):
+        message = None
+        for attempt in range(MAX_ATTEMPTS):
+            if future.done():
+                return
+
+            try:
+                await self.get_bucket(channel.id, "message").acquire()
+                if future.done():
+                    return
+
+                started = time.monotonic()
+                if isinstance(embed, list):
+                    message = await channel.send(embeds=embed)
+                else:
+                    message = await channel.send(embed=embed)
+                latency = time.monotonic() - started
+                Metrics.get_instance().observe("send", latency)
+                Logger.get_instance().log("Sent embed", job_id=job_id, tweet_id=tweet_id, latency=round(latency, 3))
+                break
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    self.fail(future, e)
+                    return
+                Logger.get_instance().log("Got 429 while sending embed", job_id=job_id, tweet_id=tweet_id)
+                self.get_bucket(channel.id, "message").pause(MESSAGE_BURST / MESSAGE_RATE)
+            except Exception as e:
+                self.fail(future, e)
+                return
+
+        if message is None:
+            self.fail(future, RuntimeError(f"Gave up after {MAX_ATTEMPTS} attempts"))
+            return
+
+        if job_id in self.stats:
+            self.stats[job_id][0] += 1
+
+        if reaction is not None:
+            try:
+                await self.get_bucket(channel.id, "reaction").acquire()
+                await message.add_reaction(reaction)
+            except Exception as e:
+                Logger.get_instance().log(f"Encountered error while adding reaction. Error: {e}")
+
+        if not future.done():
+            future.set_result(message)
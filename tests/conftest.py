@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BEARER_TOKEN', 'test')
+# The Database and Logger write next to wherever the bot runs, keep them out of the repo
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
+
+from database import Database
+from fake_twitter_api import FakeTwitterAPI
+from twitter import TwitterScraper
+
+# Every fake API numbers its users from 1, so cached ids and timelines can't carry over between tests
+@pytest.fixture(autouse=True)
+def clear_cache():
+    Database.get_instance().connection().execute("DELETE FROM entries")
+
+@pytest.fixture
+def api():
+    api = FakeTwitterAPI(timeline_length=300).start()
+    api.attach(TwitterScraper.get_instance().get_client())
+    yield api
+    api.stop()
@@ -0,0 +1,100 @@
+import asyncio
+import time
+import fetch_retry
+import pytest
+from fetch_retry import FetchStatus
+from rate_limiter import RateLimiter
+from twitter import TwitterScraper
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(fetch_retry, "BASE_DELAY", 0.01)
+
+def get_timeline_requests(api):
+    return [query for path, query in api.requests if path.endswith("/tweets")]
+
+def test_server_error_is_retried(api):
+    scraper = TwitterScraper.get_instance()
+    scraper.get_user_id("test_user")
+    api.fail_next(503, 2)
+
+    status = FetchStatus()
+    tweets, _ = scraper.get_user_tweets("test_user", 50, status)
+
+    assert len(tweets) == 50
+    assert status.complete
+    assert len(get_timeline_requests(api)) == 3
+
+def test_rate_limit_waits_for_reset(api):
+    scraper = TwitterScraper.get_instance()
+    scraper.get_user_id("test_user")
+    started = time.time()
+    api.fail_next(429, 1, reset_after=2)
+
+    status = FetchStatus()
+    tweets, _ = scraper.get_user_tweets("test_user", 50, status)
+
+    # The reset is a whole second, at least a second after the 429
+    assert time.time() >= int(started + 2)
+    assert len(tweets) == 50
+    assert status.complete
+
+def test_failing_page_keeps_earlier_pages(api):
+    status = FetchStatus()
+    pages = TwitterScraper.get_instance().iter_user_tweet_pages("test_user", 300, status)
+    fetched = [next(pages)]
+    api.fail_next(503, fetch_retry.MAX_ATTEMPTS)
+    fetched.extend(pages)
+
+    assert len(fetched) == 1
+    assert len(fetched[0][0]) == 100
+    assert not status.complete
+    assert len(status.errors) == 1
+
+def test_retry_resumes_from_same_page(api):
+    status = FetchStatus()
+    pages = TwitterScraper.get_instance().iter_user_tweet_pages("test_user", 300, status)
+    fetched = [next(pages)]
+    api.fail_next(503, 1)
+    fetched.extend(pages)
+
+    ids = [tweet.id for tweets, _ in fetched for tweet in tweets]
+    assert len(ids) == 300
+    assert ids == sorted(set(ids), reverse=True)
+    assert status.complete
+
+    requests = get_timeline_requests(api)
+    assert len(requests) == 4
+    assert "pagination_token" not in requests[0]
+    assert requests[1]["pagination_token"] == requests[2]["pagination_token"]
+    assert requests[3]["pagination_token"] != requests[2]["pagination_token"]
+
+def test_unknown_user_is_not_a_fetch_failure(api):
+    status = FetchStatus()
+    pages = list(TwitterScraper.get_instance().iter_user_tweet_pages("nobody", 100, status))
+
+    assert pages == []
+    assert status.user_missing
+    assert status.complete
+
+def test_stopping_ends_rate_limit_wait(api):
+    scraper = TwitterScraper.get_instance()
+    scraper.get_user_id("test_user")
+    api.fail_next(429, 1, reset_after=600)
+
+    async def run():
+        status = FetchStatus()
+        asyncio.get_running_loop().call_later(0.5, status.stop)
+        pages = [page async for page in scraper.get_user_tweet_pages("test_user", 50, status)]
+        return (pages, status)
+
+    started = time.monotonic()
+    try:
+        pages, status = asyncio.run(run())
+    finally:
+        # Don't leave the 10 minute window behind for the other tests
+        RateLimiter.get_instance().limits.clear()
+
+    assert time.monotonic() - started < 5
+    assert pages == []
+    assert status.complete
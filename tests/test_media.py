@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import pytest
+import tweepy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from media import MediaValidator
+from twitter import Tweet, get_image_url
+
+# path -> (status, content type) served by the stub image host
+IMAGES = {
+    "/photo.jpg": (200, "image/jpeg"),
+    "/deleted.jpg": (404, "application/json"),
+    "/page.jpg": (200, "text/html"),
+}
+
+@pytest.fixture(scope="module")
+def image_host():
+    class Handler(BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            status, content_type = IMAGES.get(self.path, (404, "text/plain"))
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def make_tweet(tweet_id, media):
+    data = {
+        "id": str(tweet_id),
+        "text": f"Tweet {tweet_id}",
+        "edit_history_tweet_ids": [str(tweet_id)],
+        "created_at": "2024-01-01T00:00:00.000Z",
+        "public_metrics": {"retweet_count": 1, "like_count": 2, "reply_count": 3, "quote_count": 0},
+    }
+    return Tweet("test_user", tweepy.Tweet(data), [tweepy.Media(item) for item in media])
+
+def test_is_reachable(image_host):
+    validator = MediaValidator.get_instance()
+    assert validator.is_reachable(image_host + "/photo.jpg")
+    assert not validator.is_reachable(image_host + "/deleted.jpg")
+    assert not validator.is_reachable(image_host + "/page.jpg")
+
+def test_validate_stream_drops_tweets_without_loading_images(image_host):
+    tweets = [
+        make_tweet(1, [{"media_key": "1", "type": "photo", "url": image_host + "/photo.jpg"}]),
+        make_tweet(2, [{"media_key": "2", "type": "photo", "url": image_host + "/deleted.jpg"}]),
+        make_tweet(3, [{"media_key": "3", "type": "photo", "url": image_host + "/page.jpg"},
+                       {"media_key": "4", "type": "photo", "url": image_host + "/photo.jpg"}]),
+    ]
+
+    async def stream():
+        for tweet in tweets:
+            yield tweet
+
+    async def run():
+        return [tweet async for tweet in MediaValidator.get_instance().validate_stream(stream(), require_media=True)]
+
+    kept = asyncio.run(run())
+    assert [tweet.id for tweet in kept] == [1, 3]
+    # Broken images of a kept tweet are dropped from its gallery
+    assert kept[1].media_urls == (image_host + "/photo.jpg",)
+
+def test_videos_and_gifs_use_preview_image():
+    photo = tweepy.Media({"media_key": "1", "type": "photo", "url": "https://pbs.twimg.com/media/1.jpg"})
+    video = tweepy.Media({"media_key": "2", "type": "video",
+                          "preview_image_url": "https://pbs.twimg.com/ext_tw_video_thumb/2.jpg"})
+    gif = tweepy.Media({"media_key": "3", "type": "animated_gif",
+                        "preview_image_url": "https://pbs.twimg.com/tweet_video_thumb/3.jpg"})
+
+    assert get_image_url(photo) == "https://pbs.twimg.com/media/1.jpg"
+    assert get_image_url(video) == "https://pbs.twimg.com/ext_tw_video_thumb/2.jpg"
+    assert get_image_url(gif) == "https://pbs.twimg.com/tweet_video_thumb/3.jpg"
+    assert make_tweet(4, [video.data, gif.data]).media_urls == (video.preview_image_url, gif.preview_image_url)
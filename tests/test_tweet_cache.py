@@ -0,0 +1,46 @@
+import time
+from database import Database
+from fake_twitter_api import make_timeline
+from tweet_cache import TweetCache
+
+def make_cached_timeline(count):
+    tweets, media = make_timeline(1, count)
+    timeline = TweetCache.make_timeline()
+    timeline["tweets"] = tweets
+    timeline["media"] = media
+    for tweet in tweets:
+        timeline["created"][int(tweet["id"])] = time.time()
+        timeline["fetched"][int(tweet["id"])] = time.time()
+    return timeline
+
+def test_timeline_is_trimmed_to_twitter_reach():
+    cache = TweetCache.get_instance()
+    timeline = make_cached_timeline(4000)
+    newest = timeline["tweets"][0]["id"]
+    cache.put_timeline(1, timeline)
+
+    cached = cache.get_timeline(1)
+    assert len(cached["tweets"]) == 3200
+    assert cached["tweets"][0]["id"] == newest
+    assert len(cached["created"]) == 3200
+    assert cached["complete"]
+    keys = {key for tweet in cached["tweets"] for key in tweet.get("attachments", {}).get("media_keys", [])}
+    assert set(cached["media"]) == keys
+
+def test_timeline_is_trimmed_to_max_bytes(monkeypatch):
+    cache = TweetCache.get_instance()
+    monkeypatch.setattr(cache, "max_bytes", 100 * 1024)
+    cache.put_timeline(1, make_cached_timeline(1000))
+
+    cached = cache.get_timeline(1)
+    assert 0 < len(cached["tweets"]) < 1000
+    assert cache.get_index()[1][0] <= 100 * 1024
+    assert not cached["complete"]
+
+def test_user_lookups_expire():
+    cache = TweetCache.get_instance()
+    cache.set_user("test_user", 1, 100)
+    assert cache.get_user("TEST_USER") == (1, 100)
+
+    Database.get_instance().add_or_update_entry("USER:test_user", (1, 100, time.time() - 2 * 24 * 60 * 60))
+    assert cache.get_user("test_user") is None
@@ -0,0 +1,49 @@
+import asyncio
+import datetime
+import pytest
+import time
+from database import Database
+from watcher import Watcher
+
+GUILD_ID = 15
+
+@pytest.fixture
+def watcher():
+    watcher = Watcher.get_instance()
+    watcher.settle_time = 60
+    yield watcher
+    Database.get_instance().remove_watch(GUILD_ID, "test_user")
+
+def test_poll_posts_new_tweets_without_waiting_for_delivery(api, watcher):
+    async def run():
+        assert await watcher.add(GUILD_ID, "test_user")
+        # Old enough to have settled, and far more engaging than anything in
+        # the baseline, so they're all selected
+        posted = api.post_tweets("test_user", 3)
+        created_at = datetime.datetime.fromtimestamp(time.time() - 120, datetime.timezone.utc)
+        for tweet in posted:
+            tweet["created_at"] = created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            tweet["public_metrics"].update(retweet_count=10 ** 6, like_count=10 ** 6, reply_count=10 ** 6)
+
+        delivered = asyncio.Event()
+        sent = []
+        async def post(guild_id, username, tweets):
+            await delivered.wait()
+            sent.extend(tweets)
+        watcher.post = post
+
+        watch, = watcher.get_watches(GUILD_ID)
+        await watcher.poll(watch, 1)
+        assert len(watcher.deliveries) == 1
+        assert len(sent) == 0
+
+        watch, = watcher.get_watches(GUILD_ID)
+        delivered.set()
+        await asyncio.gather(*watcher.deliveries)
+        return (posted, sent, watch)
+
+    posted, sent, watch = asyncio.run(run())
+    posted_ids = {int(tweet["id"]) for tweet in posted}
+    assert {tweet.id for tweet in sent} == posted_ids
+    # The next poll only asks for tweets newer than these
+    assert watch[3] == max(posted_ids)
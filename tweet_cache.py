@@ -0,0 +1,165 @@
+import os
+import pickle
+import threading
+import time
+from database import Database
+from logger import Logger
+
+# Stores previously fetched timelines in the Database so repeat scrapes only
+# have to ask Twitter for tweets newer than what we already have.
+#
+# A timeline is a dict holding the raw tweet data (newest first), the raw media
+# data by media key, when each tweet was created and when its public_metrics
+# were last fetched, and whether it reaches the oldest tweet Twitter will return
+class TweetCache:
+    __instance = None
+    __user_prefix = "USER:"
+    __timeline_prefix = "TIMELINE:"
+    __index_key = "TIMELINE_INDEX"
+    __metrics_ttl = 60 * 60 # Refresh cached metrics older than an hour
+    __refresh_window = 7 * 24 * 60 * 60 # Tweets older than a week barely gain engagement
+    __user_ttl = 24 * 60 * 60 # Look users up again after a day so follower counts stay current
+    __max_tweets = 3200 # Twitter only returns a user's last 3,200 tweets
+    __default_max_bytes = 50 * 1024 * 1024
+    __index_lock = threading.Lock()
+
+    def __init__(self):
+        if TweetCache.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            TweetCache.__instance = self
+            self.max_bytes = int(os.environ.get('TWEET_CACHE_MAX_BYTES', TweetCache.__default_max_bytes))
+            self.user_id_hits = 0
+            self.user_id_misses = 0
+            self.timeline_hits = 0
+            self.timeline_misses = 0
+
+    def get_instance():
+        if TweetCache.__instance is None:
+            TweetCache()
+        return TweetCache.__instance
+
+    def make_timeline():
+        return {"tweets": [], "media": {}, "created": {}, "fetched": {}, "complete": False}
+
+    # Returns (user_id, followers_count), or None if the user isn't cached or was looked up too long ago
+    def get_user(self, username):
+        user = Database.get_instance().get_entry(self.__user_prefix + username.lower())
+        # Entries from before they were timestamped count as expired
+        if user is None or len(user) < 3 or time.time() - user[2] > self.__user_ttl:
+            self.user_id_misses += 1
+            return None
+
+        self.user_id_hits += 1
+        return user[:2]
+
+    def set_user(self, username, user_id, followers):
+        Database.get_instance().add_or_update_entry(self.__user_prefix + username.lower(),
+                                                    (user_id, followers, time.time()))
+
+    def get_timeline(self, user_id):
+        timeline = Database.get_instance().get_entry(self.__timeline_prefix + str(user_id))
+        if timeline is None:
+            self.timeline_misses += 1
+            return None
+
+        self.timeline_hits += 1
+        with self.__index_lock:
+            index = self.get_index()
+            if user_id in index:
+                index[user_id][1] = time.time()
+                Database.get_instance().add_or_update_entry(self.__index_key, index)
+        return timeline
+
+    def put_timeline(self, user_id, timeline):
+        size = self.trim(timeline)
+        Database.get_instance().add_or_update_entry(self.__timeline_prefix + str(user_id), timeline)
+
+        with self.__index_lock:
+            index = self.get_index()
+            index[user_id] = [size, time.time()]
+            self.evict(index, keep=user_id)
+            Database.get_instance().add_or_update_entry(self.__index_key, index)
+
+    def get_index(self):
+        index = Database.get_instance().get_entry(self.__index_key)
+        return index if index is not None else {}
+
+    # Each put adds the new tweets to the cached ones, so drop the oldest past
+    # what Twitter would return, and past max_bytes since eviction never drops
+    # the timeline being stored. Returns the timeline's pickled size
+    def trim(self, timeline):
+        if len(timeline["tweets"]) > self.__max_tweets:
+            TweetCache.drop_oldest(timeline, self.__max_tweets)
+            # Still reaches the oldest tweet Twitter would return
+            timeline["complete"] = True
+
+        size = len(pickle.dumps(timeline))
+        while size > self.max_bytes and len(timeline["tweets"]) > 0:
+            TweetCache.drop_oldest(timeline, len(timeline["tweets"]) // 2)
+            # Twitter has older tweets than the cache now
+            timeline["complete"] = False
+            size = len(pickle.dumps(timeline))
+        return size
+
+    def drop_oldest(timeline, keep):
+        removed = timeline["tweets"][keep:]
+        del timeline["tweets"][keep:]
+        for data in removed:
+            tweet_id = int(data["id"])
+            timeline["created"].pop(tweet_id, None)
+            timeline["fetched"].pop(tweet_id, None)
+            for key in data.get("attachments", {}).get("media_keys", []):
+                timeline["media"].pop(key, None)
+
+    # Drop least recently used timelines until the cache fits in max_bytes
+    def evict(self, index, keep=None):
+        total = sum(size for size, _ in index.values())
+        by_age = sorted(index.items(), key=lambda item: item[1][1])
+        for user_id, (size, _) in by_age:
+            if total <= self.max_bytes:
+                break
+            if user_id == keep:
+                continue
+
+            Logger.get_instance().log(f"Evicting cached timeline of user {user_id} ({size} bytes)")
+            Database.get_instance().remove_entry(self.__timeline_prefix + str(user_id))
+            del index[user_id]
+            total -= size
+
+    # Append raw tweepy tweets/media to the end (oldest side) of a timeline
+    def add_tweets(timeline, tweets, media):
+        now = time.time()
+        data = []
+        for tweet in tweets:
+            data.append(tweet.data)
+            timeline["created"][tweet.id] = tweet.created_at.timestamp()
+            timeline["fetched"][tweet.id] = now
+
+        for item in media:
+            timeline["media"][item["media_key"]] = item.data
+
+        timeline["tweets"].extend(data)
+
+    # Recent tweets whose cached public_metrics are past the TTL
+    def stale_tweet_ids(self, timeline, tweet_ids):
+        now = time.time()
+        stale = []
+        for tweet_id in tweet_ids:
+            is_recent = now - timeline["created"].get(tweet_id, 0) < self.__refresh_window
+            is_expired = now - timeline["fetched"].get(tweet_id, 0) > self.__metrics_ttl
+            if is_recent and is_expired:
+                stale.append(tweet_id)
+        return stale
+
+    def update_metrics(timeline, metrics):
+        now = time.time()
+        for data in timeline["tweets"]:
+            tweet_id = int(data["id"])
+            if tweet_id in metrics:
+                data["public_metrics"] = metrics[tweet_id]
+                timeline["fetched"][tweet_id] = now
+
+    def stats(self):
+        return (f"user ids {self.user_id_hits} hits/{self.user_id_misses} misses, "
+                f"timelines {self.timeline_hits} hits/{self.timeline_misses} misses")
@@ -0,0 +1,93 @@
+import math
+import operator
+from logger import Logger
+
+NUM_QUANTILES = 10
+QUANTILE_THRESHOLD = 6 # 7th decile
+STD_DEV_THRESHOLD = 1
+
+# Mean, sample standard deviation and quantile cut points of one metric column.
+# Sums are taken once with builtins and the column is sorted once for the quantiles
+class ColumnStats:
+    def __init__(self, column):
+        n = len(column)
+        total = sum(column)
+        squares = sum(map(operator.mul, column, column))
+
+        self.mean = total / n
+        # Numerator stays an exact integer for integer columns
+        self.std_dev = math.sqrt(max(n * squares - total * total, 0) / (n * (n - 1)))
+        self.quantiles = self.get_quantiles(sorted(column), NUM_QUANTILES)
+
+    # Same cut points as statistics.quantiles(data, n=n) ("exclusive" method)
+    def get_quantiles(self, data, n):
+        m = len(data) + 1
+        result = []
+        for i in range(1, n):
+            j = min(max(i * m // n, 1), len(data) - 1)
+            delta = i * m - j * n
+            result.append((data[j - 1] * (n - delta) + data[j] * delta) / n)
+        return result
+
+    def z_threshold(self):
+        return self.mean + STD_DEV_THRESHOLD * self.std_dev
+
+    def quantile_threshold(self):
+        return self.quantiles[QUANTILE_THRESHOLD]
+
+def get_column_stats(user):
+    return (ColumnStats(user.rt_counts), ColumnStats(user.like_counts), ColumnStats(user.reply_counts))
+
+# Selection strategies take a User and return a mask with one bool per tweet
+
+# Retweets, likes or replies more than a standard deviation above the mean
+def select_z_score(user):
+    rt, like, reply = get_column_stats(user)
+    rt_min, like_min, reply_min = rt.z_threshold(), like.z_threshold(), reply.z_threshold()
+    return [r > rt_min or l > like_min or p > reply_min
+            for r, l, p in zip(user.rt_counts, user.like_counts, user.reply_counts)]
+
+# Retweets, likes or replies in the top deciles
+def select_quantile(user):
+    rt, like, reply = get_column_stats(user)
+    rt_min, like_min, reply_min = rt.quantile_threshold(), like.quantile_threshold(), reply.quantile_threshold()
+    return [r >= rt_min or l >= like_min or p >= reply_min
+            for r, l, p in zip(user.rt_counts, user.like_counts, user.reply_counts)]
+
+# The original criteria: either of the above
+def select_default(user):
+    rt, like, reply = get_column_stats(user)
+    rt_std, like_std, reply_std = rt.z_threshold(), like.z_threshold(), reply.z_threshold()
+    rt_quant, like_quant, reply_quant = rt.quantile_threshold(), like.quantile_threshold(), reply.quantile_threshold()
+    return [r > rt_std or l > like_std or p > reply_std or r >= rt_quant or l >= like_quant or p >= reply_quant
+            for r, l, p in zip(user.rt_counts, user.like_counts, user.reply_counts)]
+
+# Total engagement per follower, more than a standard deviation above the mean
+def select_engagement_rate(user):
+    rates = [(r + l + p) / user.followers
+             for r, l, p in zip(user.rt_counts, user.like_counts, user.reply_counts)]
+    threshold = ColumnStats(rates).z_threshold()
+    return [rate > threshold for rate in rates]
+
+STRATEGIES = {
+    "default": select_default,
+    "z_score": select_z_score,
+    "quantile": select_quantile,
+    "engagement_rate": select_engagement_rate,
+}
+
+# The strategy select will actually use for user. Worker processes are only
+# sent resolved strategies, so they never have anything to log
+def resolve_strategy(user, strategy):
+    if strategy not in STRATEGIES:
+        Logger.get_instance().log(f"Unknown selection strategy {strategy}, using default")
+        return "default"
+    if strategy == "engagement_rate" and not user.followers:
+        Logger.get_instance().log("Follower count unknown, falling back to default selection")
+        return "default"
+    return strategy
+
+def select(user, strategy="default"):
+    strategy = resolve_strategy(user, strategy)
+    mask = STRATEGIES[strategy](user)
+    return [tweet for tweet, is_good in zip(user.tweets, mask) if is_good]
@@ -1,62 +1,145 @@
-import tweepy
-import statistics
+import asyncio
+import contextlib
+import contextvars
+import tweet_stats
 import re
-import pytz
 import os
+import time
+import functools
+import threading
+import rate_limiter
+from array import array
 from logger import Logger
+from lazy import lazy_import
+from tweet_cache import TweetCache
+from rate_limiter import RateLimiter
+from fetch_retry import call_with_retries, stop_event, FetchStopped
+from fetch_stats import FetchStats
+from metrics import Metrics
+from workers import WorkerPool
+import datetime
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
+tweepy = lazy_import("tweepy")
+pytz = lazy_import("pytz")
+
+DEFAULT_TIMEZONE = 'America/New_York'
+
+# Fields and expansions requested by each command, only what's turned into
+# Tweet records. Referenced tweets and possibly_sensitive were never read.
+# Every profile keeps the fields the tweet cache relies on, so cached
+# timelines can be shared between them
+TIMELINE_FIELDS = {
+    "expansions": ["attachments.media_keys"],
+    "media_fields": ["url", "preview_image_url"],
+    "tweet_fields": ["created_at", "public_metrics"],
+}
+FETCH_PROFILES = {
+    "best": TIMELINE_FIELDS,
+    "images": TIMELINE_FIELDS,
+    "watch": TIMELINE_FIELDS,
+}
+LINK_PATTERN = re.compile(r'http\S+')
+HANDLE_PATTERN = re.compile(r'[A-Za-z0-9_]{1,15}')
+loaded_timezones = {}
+
+# pytz lookups are slow, only do them once per timezone name
+def get_timezone(name):
+    if name not in loaded_timezones:
+        loaded_timezones[name] = pytz.timezone(name)
+    return loaded_timezones[name]
+
+# Photos have a url, videos and GIFs only have a preview image
+def get_image_url(media):
+    if media["url"] != None:
+        return media["url"]
+    return media["preview_image_url"]
+
+# The handle doesn't belong to any account, Twitter answers without data
+class UserNotFound(Exception):
+    pass
+
+# Only the raw fields are stored, display strings are built when an embed needs them
 class Tweet:
+    __slots__ = ("id", "username", "created_at", "rt_count", "like_count", "reply_count", "media_urls", "text")
+
     def __init__(self, username, tweet, media):
         # Tweet ID
         self.id = tweet.id
-        
-        # Retweet Count
-        self.rt_count = tweet.public_metrics["retweet_count"]
-
-        # Like Count
-        self.like_count = tweet.public_metrics["like_count"]
 
-        # Reply Count
-        self.reply_count = tweet.public_metrics["reply_count"]
+        # Retweet, Like and Reply Counts
+        metrics = tweet.public_metrics
+        self.rt_count = metrics["retweet_count"]
+        self.like_count = metrics["like_count"]
+        self.reply_count = metrics["reply_count"]
 
         # Username
         self.username = username
 
-        # Timestamp
-        timestamp = tweet.created_at
-        self.timestamp = (timestamp.astimezone(pytz.timezone('America/New_York'))) \
-                        .strftime("%b %d %Y %I:%M:%S %p")
+        # Timestamp, as seconds since the epoch
+        self.created_at = tweet.created_at.timestamp()
 
-        # Link
-        self.link = f"https://twitter.com/{self.username}/status/{tweet.id}";
+        # Images, all of them so multi-image tweets can be shown as a gallery
+        self.media_urls = tuple(url for url in map(get_image_url, media) if url != None)
 
-        # Image
-        self.media_url = media["url"] if (media != None) else None
-        
         # Content
-        content = tweet.text
+        self.text = tweet.text
+
+    @property
+    def media_url(self):
+        return self.media_urls[0] if len(self.media_urls) > 0 else None
+
+    @property
+    def engagement(self):
+        return self.rt_count + self.like_count + self.reply_count
+
+    @property
+    def link(self):
+        return f"https://twitter.com/{self.username}/status/{self.id}"
+
+    @property
+    def content(self):
+        content = self.text
         content = content.replace('\n', ' ')
         content = content.replace('"', '\\"')
-        self.content = re.sub(r'http\S+', '', content)
+        return LINK_PATTERN.sub('', content)
+
+    def get_timestamp(self, timezone=DEFAULT_TIMEZONE):
+        timestamp = datetime.datetime.fromtimestamp(self.created_at, get_timezone(timezone))
+        return timestamp.strftime("%b %d %Y %I:%M:%S %p")
         
+# Metrics are kept in columns lined up with tweets so the statistics can work
+# on whole columns at once
 class User:
-    def __init__(self):
+    def __init__(self, followers=None):
+        self.followers = followers
         self.tweets = []
-        self.rt_counts = []
-        self.like_counts = [] 
-        self.reply_counts = []
+        self.rt_counts = array('q')
+        self.like_counts = array('q')
+        self.reply_counts = array('q')
         
     def add_tweet(self, tweet):
         self.tweets.append(tweet)
         self.rt_counts.append(tweet.rt_count)
         self.like_counts.append(tweet.like_count)
         self.reply_counts.append(tweet.reply_count)
+
+    # Metrics of an older tweet that only count towards the statistics, its
+    # place in tweets is None so it's never selected itself
+    def add_metrics(self, rt_count, like_count, reply_count):
+        self.tweets.append(None)
+        self.rt_counts.append(rt_count)
+        self.like_counts.append(like_count)
+        self.reply_counts.append(reply_count)
         
     def sort_tweets(self):
-        self.tweets = sorted(self.tweets, key=lambda t: t.like_count, reverse=True)
+        order = sorted(range(len(self.tweets)), key=lambda i: self.like_counts[i], reverse=True)
+        self.tweets = [self.tweets[i] for i in order]
+        self.rt_counts = array('q', (self.rt_counts[i] for i in order))
+        self.like_counts = array('q', (self.like_counts[i] for i in order))
+        self.reply_counts = array('q', (self.reply_counts[i] for i in order))
         
     def num_tweets(self):
         return len(self.tweets)
@@ -69,12 +152,21 @@ class TwitterScraper:
             print("Tried to recreate instance")
         else:
             TwitterScraper.__instance = self
+            self.client = None
+            self.client_lock = threading.Lock()
         
     def get_instance():
         if TwitterScraper.__instance is None:
             TwitterScraper()
         return TwitterScraper.__instance
 
+    # Authorizes on the first scrape instead of at startup. Called from executor threads
+    def get_client(self):
+        with self.client_lock:
+            if self.client is None:
+                self.authorize()
+        return self.client
+
     def authorize(self):
         Logger.get_instance().log("Beginning Twitter authorization")
 
@@ -83,141 +175,361 @@ class TwitterScraper:
 
         # Authorize V2 tweepy client
         self.client = tweepy.Client(bearer_token=bearer_token)
+
+        # Keep track of every endpoint's rate limit from the response headers
+        self.client.session.hooks["response"].append(RateLimiter.get_instance().record)
+        self.client.session.hooks["response"].append(FetchStats.get_instance().record_response)
         Logger.get_instance().log("Finished Twitter authorization")
 
-    def get_user_tweets(self, username, count):
+    # Wrap a client method so every call waits for room in the endpoint's rate
+    # limit, and transient errors are retried with the same arguments. For
+    # paginated calls that means resuming from the same pagination_token
+    def rate_limited(self, method, endpoint):
+        @functools.wraps(method)
+        def call(*args, **kwargs):
+            def attempt():
+                RateLimiter.get_instance().acquire(endpoint)
+                return method(*args, **kwargs)
+            return call_with_retries(attempt, endpoint)
+        return call
+
+    # Returns (user_id, followers_count)
+    def get_user_info(self, username):
+        get_user = self.rate_limited(self.get_client().get_user, rate_limiter.USER_BY_USERNAME)
+        user = get_user(username=username, user_fields=["public_metrics"])
+        if user.data is None:
+            raise UserNotFound(f"Couldn't find @{username}")
+        return (user.data.id, user.data.public_metrics["followers_count"])
+
+    # Look up many users at once, 100 per request, skipping ones already cached.
+    # Returns the usernames that were found
+    def resolve_users(self, usernames):
+        cache = TweetCache.get_instance()
+        missing = [username for username in usernames if cache.get_user(username) is None]
+        get_users = self.rate_limited(self.get_client().get_users, rate_limiter.USERS_BY_USERNAMES)
+        for i in range(0, len(missing), 100):
+            response = get_users(usernames=missing[i:i + 100], user_fields=["public_metrics"])
+            for user in response.data or []:
+                cache.set_user(user.username, user.id, user.public_metrics["followers_count"])
+
+        return [username for username in usernames if cache.get_user(username) is not None]
+
+    def get_user_id(self, username):
+        cache = TweetCache.get_instance()
+        user = cache.get_user(username)
+        if user is None:
+            user = self.get_user_info(username)
+            cache.set_user(username, user[0], user[1])
+        return user[0]
+
+    # Follower count from the last lookup of the user, if any
+    def get_followers(self, username):
+        user = TweetCache.get_instance().get_user(username)
+        return user[1] if user is not None else None
+
+    def get_tweet_pages(self, user_id, count, profile="best", **kwargs):
+        # Variables for the params to make it easier to tweak
+        excludes = ["replies", "retweets"]
+        fields = FETCH_PROFILES[profile]
+        limit = (count // 100) + 1
+        max_results = min(max(count, 5), 100)
+
+        # Twitter v2 API only allows up to 100 messages per request
+        # Use Paginator to aggregate all requests to get up to count tweets
+        get_users_tweets = self.rate_limited(self.get_client().get_users_tweets, rate_limiter.USER_TWEETS)
+        return tweepy.Paginator(get_users_tweets, user_id,
+                                limit=limit,
+                                exclude=excludes,
+                                expansions=fields["expansions"],
+                                media_fields=fields["media_fields"],
+                                tweet_fields=fields["tweet_fields"],
+                                max_results=max_results,
+                                **kwargs)
+
+    # Yields (tweets, media) for up to count tweets, and whether Twitter has more after them
+    def fetch_pages(self, user_id, count, profile="best", **kwargs):
+        remaining = count
+        started = time.monotonic()
+        stats = FetchStats.get_instance()
+        for response in self.get_tweet_pages(user_id, count, profile, **kwargs):
+            tweets = (response.data or [])[:remaining]
+            media = response.includes.get("media", [])
+            remaining -= len(tweets)
+            has_more = "next_token" in response.meta
+
+            latency = time.monotonic() - started
+            size = stats.take_last_bytes()
+            stats.add_page(profile, len(tweets), size, latency)
+            Metrics.get_instance().observe("fetch_page", latency)
+            Metrics.get_instance().count("tweets_fetched", len(tweets))
+            Logger.get_instance().log(f"Got {len(tweets)} from this response", user_id=user_id, profile=profile,
+                                      bytes=size, latency=round(latency, 3))
+            yield (tweets, media, has_more)
+            if remaining <= 0:
+                break
+            started = time.monotonic()
+
+    # Re-fetch public_metrics of recent cached tweets whose metrics are past the TTL
+    def refresh_metrics(self, timeline, tweet_ids):
+        stale = TweetCache.get_instance().stale_tweet_ids(timeline, tweet_ids)
+        if len(stale) == 0:
+            return
+
+        Logger.get_instance().log(f"Refreshing metrics of {len(stale)} cached tweets")
+        metrics = {}
+        get_tweets = self.rate_limited(self.get_client().get_tweets, rate_limiter.TWEETS)
+        for i in range(0, len(stale), 100):
+            response = get_tweets(ids=stale[i:i + 100], tweet_fields=["public_metrics"])
+            for tweet in response.data or []:
+                metrics[tweet.id] = tweet.public_metrics
+
+        TweetCache.update_metrics(timeline, metrics)
+
+    # Yields the user's last count tweets as (tweets, media) pages, newest first.
+    # If Twitter keeps failing, the pages fetched so far are kept and status is
+    # marked incomplete instead of throwing everything away
+    def iter_user_tweet_pages(self, username, count, status=None, profile="best"):
+        try:
+            yield from self.iter_timeline_pages(username, count, profile)
+        except FetchStopped:
+            Logger.get_instance().log(f"Stopped fetching @{username}'s tweets")
+        except UserNotFound as e:
+            # Not a fetch failure, there's nothing to fetch
+            Logger.get_instance().log(str(e))
+            if status is not None:
+                status.user_missing = True
+        except Exception as e:
+            Logger.get_instance().log(f"Gave up fetching @{username}'s tweets. Error: {e}")
+            if status is not None:
+                status.fail(e)
+
+    # Only tweets newer than the cached timeline (and older ones if the cache
+    # doesn't reach back far enough) are requested from Twitter. The cache is
+    # only updated once every page has been fetched
+    def iter_timeline_pages(self, username, count, profile="best"):
+        cache = TweetCache.get_instance()
+        user_id = self.get_user_id(username)
+
+        cached = cache.get_timeline(user_id)
+        timeline = TweetCache.make_timeline()
+        remaining = count
+
+        # New tweets since the last scrape
+        since_id = None
+        if cached is not None and len(cached["tweets"]) > 0:
+            since_id = cached["tweets"][0]["id"]
+
+        has_more = False
+        for tweets, media, has_more in self.fetch_pages(user_id, remaining, profile, since_id=since_id):
+            TweetCache.add_tweets(timeline, tweets, media)
+            remaining -= len(tweets)
+            yield (tweets, media)
+
+        # If there could be tweets between the new ones and the cached ones, the
+        # cached timeline can't be reused
+        if cached is not None and since_id is not None and not has_more:
+            # Refreshed before the tweets are built, since each keeps its own copy of the metrics
+            self.refresh_metrics(cached, [int(data["id"]) for data in cached["tweets"][:remaining]])
+            tweets = [tweepy.Tweet(data) for data in cached["tweets"][:remaining]]
+
+            media = []
+            for tweet in tweets:
+                if (tweet.attachments != None) and ("media_keys" in tweet.attachments):
+                    media.extend(tweepy.Media(cached["media"][key]) for key in tweet.attachments["media_keys"]
+                                 if key in cached["media"])
+
+            Logger.get_instance().log(f"Got {len(tweets)} from the cache", username=username)
+            remaining -= len(tweets)
+            if len(tweets) > 0:
+                yield (tweets, media)
+
+            timeline["tweets"].extend(cached["tweets"])
+            timeline["media"].update(cached["media"])
+            timeline["created"].update(cached["created"])
+            timeline["fetched"].update(cached["fetched"])
+            timeline["complete"] = cached["complete"]
+            has_more = not cached["complete"]
+        elif since_id is None:
+            timeline["complete"] = not has_more
+
+        # Older tweets than what's been fetched or cached so far
+        if remaining > 0 and has_more and len(timeline["tweets"]) > 0:
+            until_id = timeline["tweets"][-1]["id"]
+            has_more = False
+            for tweets, media, has_more in self.fetch_pages(user_id, remaining, profile, until_id=until_id):
+                TweetCache.add_tweets(timeline, tweets, media)
+                remaining -= len(tweets)
+                yield (tweets, media)
+            timeline["complete"] = not has_more
+
+        cache.put_timeline(user_id, timeline)
+        Logger.get_instance().log(f"Tweet cache: {cache.stats()}")
+
+    # Tweets newer than since_id but posted before end_time, so their metrics have
+    # had time to settle. If there are more than count, only the newest are returned
+    def get_new_tweets(self, username, since_id, end_time, count=100):
+        user_id = self.get_user_id(username)
+        new_tweets = []
+        media_index = {}
+        for tweets, media, _ in self.fetch_pages(user_id, count, "watch", since_id=since_id,
+                                                end_time=end_time):
+            self.index_media(media, media_index)
+            new_tweets.extend(self.build_tweets(username, tweets, media_index))
+
+        Logger.get_instance().log(f"Retrieved {len(new_tweets)} new tweets from @{username}")
+        return new_tweets
+
+    # Returns the user's tweets and their media indexed by media key
+    def get_user_tweets(self, username, count, status=None, profile="best"):
         Logger.get_instance().log(f"Attempting to scrape Twitter user @{username}'s {count} last tweets")
         user_tweets = []
-        user_media = []
+        user_media = {}
         
+        for tweets, media in self.iter_user_tweet_pages(username, count, status, profile):
+            user_tweets.extend(tweets)
+            self.index_media(media, user_media)
+
+        Logger.get_instance().log(f"Retrieved {len(user_tweets)} from @{username}")
+        return (user_tweets, user_media)
+
+    # Async version of get_user_tweets that yields (tweets, media) one page at a time.
+    # The blocking tweepy requests run in the default executor so the Discord
+    # event loop keeps running while the timeline is being fetched
+    async def get_user_tweet_pages(self, username, count, status=None, profile="best"):
+        Logger.get_instance().log(f"Attempting to stream Twitter user @{username}'s {count} last tweets")
+        loop = asyncio.get_running_loop()
+        pages = self.iter_user_tweet_pages(username, count, status, profile)
+        retrieved = 0
+
+        # Pages are fetched in this context, so stopping the job cuts short
+        # any wait for a rate limit or retry in the executor thread
+        context = contextvars.copy_context()
+        if status is not None:
+            context.run(stop_event.set, status.stopped)
+
         try:
-            # Get User ID
-            user = self.client.get_user(username=username)
-            user_id = user.data.id
-
-            # Variables for the params to make it easier to tweak
-            excludes = ["replies", "retweets"]
-            expands = ["referenced_tweets.id", "attachments.media_keys"]
-            medias =  ["public_metrics", "preview_image_url", "url"]
-            tweet_fs = ["created_at", "public_metrics", "possibly_sensitive"]
-            limit = (count // 100) + 1
-            max_results = (count if (count <= 100) else 100)
-
-            # Twitter v2 API only allows up to 100 messages per request
-            # Use Paginator to aggregate all requests to get up to count tweets
-            for response in tweepy.Paginator(self.client.get_users_tweets, user_id, 
-                                             limit=limit,
-                                             exclude=excludes,
-                                             expansions=expands,
-                                             media_fields=medias,
-                                             tweet_fields=tweet_fs,
-                                             max_results=max_results):
-                tweets = response.data
-                media = None
-                if "media" in response.includes:
-                    media = response.includes["media"]
-                    user_media.extend(media)
-
-                Logger.get_instance().log(f"Got {len(tweets)} from this response")
-                user_tweets.extend(tweets)            
+            while status is None or not status.stopped.is_set():
+                page = await loop.run_in_executor(None, context.run, next, pages, None)
+                if page is None:
+                    break
+
+                retrieved += len(page[0])
+                yield page
         except Exception as e:
             Logger.get_instance().log("Unknown exception occured")
             Logger.get_instance().log(f"Error: {e}")
-            return None
+            return
 
-        if len(user_tweets) > count:
-            user_tweets = user_tweets[:count]
-            
-        Logger.get_instance().log(f"Retrieved {len(user_tweets)} from @{username}")
-        return (user_tweets, user_media)
+        Logger.get_instance().log(f"Retrieved {retrieved} from @{username}")
+
+    # Add a page of media to the media key index
+    def index_media(self, media, media_index):
+        for item in media:
+            media_index[item["media_key"]] = item
+
+    def join_media(self, tweet, media_index):
+        if (tweet.attachments == None) or ("media_keys" not in tweet.attachments):
+            return []
+
+        return [media_index[key] for key in tweet.attachments["media_keys"] if key in media_index]
+
+    # Join raw tweets with their media and wrap them in Tweet objects
+    def build_tweets(self, username, user_tweets, media_index):
+        return [Tweet(username, tweet, self.join_media(tweet, media_index)) for tweet in user_tweets]
         
-    def scrape_user(self, username, count):
-        # Retrieve user's last tweets
-        result = self.get_user_tweets(username, count)
+    # Stream Tweet objects as soon as each page comes back from Twitter
+    async def stream_user_tweets(self, username, count, status=None):
+        media_index = {}
+        async for user_tweets, user_media in self.get_user_tweet_pages(username, count, status):
+            self.index_media(user_media, media_index)
+            for tweet in self.build_tweets(username, user_tweets, media_index):
+                yield tweet
 
-        if result is None:
-            return None
+    # Tweets without attachments are dropped before any Tweet record is built for them
+    async def stream_tweets_with_images(self, username, count, status=None):
+        media_index = {}
+        async for user_tweets, user_media in self.get_user_tweet_pages(username, count, status, "images"):
+            self.index_media(user_media, media_index)
+            user_tweets = [tweet for tweet in user_tweets
+                           if (tweet.attachments != None) and ("media_keys" in tweet.attachments)]
+            for tweet in self.build_tweets(username, user_tweets, media_index):
+                if tweet.media_url is None:
+                    continue
 
-        user_tweets = result[0]
-        user_media = result[1]
-            
-        if len(user_tweets) < 3:
-            return None
+                yield tweet
 
+    # Collects every page without blocking the event loop, then runs the
+    # statistics stage in the executor once the last page has arrived
+    async def get_best_tweets_async(self, username, count, strategy="default", status=None):
         user = User()
-        for tweet in user_tweets:
-            media = None
-
-            if (tweet.attachments != None) and ("media_keys" in tweet.attachments):
-                media_key = tweet.attachments["media_keys"][0]
-                media_item = [m for m in user_media if (media_key == m["media_key"])]
-                if len(media_item) > 0:
-                    media = media_item[0]
-            
-            this_tweet = Tweet(username, tweet, media)
-            user.add_tweet(this_tweet)
-            
+        async for tweet in self.stream_user_tweets(username, count, status):
+            user.add_tweet(tweet)
+
+        if user.num_tweets() < 3:
+            return None
+
+        user.followers = self.get_followers(username)
+
         # Sort tweets by likes
         user.sort_tweets()
 
-        return user
+        pool = WorkerPool.get_instance()
+        if not pool.is_enabled():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.select_best_tweets, user, strategy)
 
-    def get_tweets_with_images(self, username, count):
-        selected_tweets = []
+        started = time.monotonic()
+        selected_tweets = await pool.select(user, strategy)
+        Metrics.get_instance().observe("select", time.monotonic() - started)
+        Logger.get_instance().log(f"Found {len(selected_tweets)} that met {strategy} criteria in a worker process")
+        return selected_tweets
 
-        user = self.scrape_user(username, count)
-        if user is None:
-            return None
-            
-        for tweet in user.tweets:
-            if tweet.media_url is None:
-               continue
+    def select_best_tweets(self, user, strategy="default"):
+        started = time.monotonic()
+        selected_tweets = tweet_stats.select(user, strategy)
+        Metrics.get_instance().observe("select", time.monotonic() - started)
+        Logger.get_instance().log(f"Found {len(selected_tweets)} that met {strategy} criteria")
+        return selected_tweets
 
-            selected_tweets.append(tweet)
+    # Scrape several accounts concurrently, each judged against its own
+    # statistics, then rank everything together by engagement per follower.
+    # fetch_slots is the bot-wide limit on concurrent scrapes, held per account
+    # so the fan-out counts against it too.
+    # Returns (tweets, usernames that weren't found), or None if the users couldn't be looked up
+    async def get_best_tweets_many(self, usernames, count, strategy="default", concurrency=4, status=None,
+                                   fetch_slots=None):
+        if fetch_slots is None:
+            fetch_slots = contextlib.nullcontext()
 
-        Logger.get_instance().log(f"Found {len(selected_tweets)} tweets with images")
-        if len(selected_tweets) < 2:
+        # One malformed handle would fail the whole batched lookup
+        valid = [username for username in usernames if HANDLE_PATTERN.fullmatch(username)]
+        loop = asyncio.get_running_loop()
+        try:
+            async with fetch_slots:
+                found = await loop.run_in_executor(None, self.resolve_users, valid)
+        except Exception as e:
+            Logger.get_instance().log(f"Gave up looking up {len(valid)} users. Error: {e}")
+            if status is None:
+                raise
+            status.fail(e)
             return None
-        
-        return selected_tweets
-        
-    def get_best_tweets(self, username, count):
-        num_quantiles = 10
-        quantile_threshold = 6
+        missing = [username for username in usernames if username not in found]
 
-        user = self.scrape_user(username, count)
-        if user is None:
-            return None
-            
-        # Calculate different statistics about tweet's performance
-        rt_mean = statistics.mean(user.rt_counts)
-        like_mean = statistics.mean(user.like_counts)
-        reply_mean = statistics.mean(user.reply_counts)
-        
-        rt_std_dev = statistics.stdev(user.rt_counts)
-        like_std_dev = statistics.stdev(user.like_counts)
-        reply_std_dev = statistics.stdev(user.reply_counts)
-        
-        rt_quant = statistics.quantiles(user.rt_counts, n=num_quantiles)[quantile_threshold]
-        like_quant = statistics.quantiles(user.like_counts, n=num_quantiles)[quantile_threshold]
-        reply_quant = statistics.quantiles(user.reply_counts, n=num_quantiles)[quantile_threshold]
-        
-        selected_tweets = []
-
-        # Check if each tweet performed well
-        for tweet in user.tweets:
-            is_good = False
-            
-            is_good |= tweet.rt_count > (rt_mean + rt_std_dev) # Retweet Standard Deviation
-            is_good |= tweet.like_count > (like_mean + like_std_dev) # Like Standard Deviation
-            is_good |= tweet.reply_count > (reply_mean + reply_std_dev) # Reply Standard Devation
-            
-            is_good |= tweet.rt_count >= rt_quant # Retweet Quantile
-            is_good |= tweet.like_count >= like_quant # Like Quantile
-            is_good |= tweet.reply_count >= reply_quant # Reply Quantile
-
-            if is_good:
-                selected_tweets.append(tweet)
-
-        Logger.get_instance().log(f"Found {len(selected_tweets)} that met criteria")
-        return selected_tweets
+        slots = asyncio.Semaphore(concurrency)
+        async def scrape(username):
+            async with slots, fetch_slots:
+                return await self.get_best_tweets_async(username, count, strategy, status)
+
+        results = await asyncio.gather(*(scrape(username) for username in found))
+
+        ranked = []
+        for username, tweets in zip(found, results):
+            if tweets is None:
+                continue
+
+            followers = max(self.get_followers(username) or 0, 1)
+            ranked.extend((tweet.engagement / followers, tweet) for tweet in tweets)
+
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        Logger.get_instance().log(f"Found {len(ranked)} tweets across {len(found)} accounts")
+        return ([tweet for _, tweet in ranked], missing)
@@ -0,0 +1,178 @@
+import asyncio
+import datetime
+import os
+import random
+import time
+import tweet_stats
+from database import Database
+from jobs import JobManager
+from logger import Logger
+from twitter import TwitterScraper, User
+
+BASELINE_SIZE = 200 # recent tweets each account's new tweets are judged against
+POLL_COUNT = 100 # one page of new tweets per poll
+MIN_TWEETS = 3
+
+# Polls watched accounts in the background, asking Twitter only for tweets
+# newer than the last poll, and posts the ones that beat the account's
+# engagement baseline. Accounts that keep tweeting are polled more often,
+# quiet ones back off, and all intervals stretch so the polls fit in a daily
+# request budget however many accounts are watched
+class Watcher:
+    __instance = None
+    __default_min_interval = 5 * 60 # seconds
+    __default_max_interval = 6 * 60 * 60 # seconds
+    __default_settle_time = 2 * 60 * 60 # seconds
+    __default_daily_requests = 1000
+    __max_sleep = 60 # seconds, so removed or rescheduled watches are noticed
+
+    def __init__(self):
+        if Watcher.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            Watcher.__instance = self
+            self.min_interval = float(os.environ.get('WATCH_MIN_INTERVAL', Watcher.__default_min_interval))
+            self.max_interval = float(os.environ.get('WATCH_MAX_INTERVAL', Watcher.__default_max_interval))
+            # Tweets are only judged once they're this old, brand new tweets haven't had time to get engagement
+            self.settle_time = float(os.environ.get('WATCH_SETTLE_TIME', Watcher.__default_settle_time))
+            self.daily_requests = int(os.environ.get('WATCH_DAILY_REQUESTS', Watcher.__default_daily_requests))
+            self.post = None
+            self.wakeup = None
+            self.worker = None
+            self.deliveries = set() # posts still being sent, referenced so they aren't garbage collected
+
+    def get_instance():
+        if Watcher.__instance is None:
+            Watcher()
+        return Watcher.__instance
+
+    # post is a coroutine function taking (guild_id, username, tweets)
+    def start(self, post):
+        self.post = post
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.create_task(self.run())
+
+    # Shortest interval that keeps every watched account within the daily budget
+    def get_quota_interval(self, num_watches):
+        return num_watches * 24 * 60 * 60 / self.daily_requests
+
+    def get_next_poll(self, interval, num_watches):
+        interval = max(interval, self.get_quota_interval(num_watches))
+        # Jitter keeps accounts added together from being polled together forever
+        return time.time() + interval * random.uniform(0.9, 1.1)
+
+    # Returns False if the account couldn't be found or has too few tweets
+    async def add(self, guild_id, username, strategy="default"):
+        loop = asyncio.get_running_loop()
+        scraper = TwitterScraper.get_instance()
+        async with JobManager.get_instance().fetch_slots:
+            result = await loop.run_in_executor(None, scraper.get_user_tweets, username, BASELINE_SIZE)
+        tweets = scraper.build_tweets(username, result[0], result[1])
+        if len(tweets) < MIN_TWEETS:
+            return False
+
+        # Oldest first so trimming the baseline drops the oldest tweets
+        tweets.reverse()
+        baseline = {
+            "rt": [tweet.rt_count for tweet in tweets],
+            "like": [tweet.like_count for tweet in tweets],
+            "reply": [tweet.reply_count for tweet in tweets],
+        }
+        since_id = max(tweet.id for tweet in tweets)
+
+        num_watches = len(Database.get_instance().get_watches()) + 1
+        # Staggered over the first interval instead of all polling at once
+        next_poll_at = time.time() + random.uniform(0, max(self.min_interval, self.get_quota_interval(num_watches)))
+        Database.get_instance().add_watch(guild_id, username, strategy, since_id, self.min_interval,
+                                          next_poll_at, baseline)
+        Logger.get_instance().log(f"Watching @{username} in guild {guild_id}")
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return True
+
+    def remove(self, guild_id, username):
+        return Database.get_instance().remove_watch(guild_id, username)
+
+    def get_watches(self, guild_id):
+        return Database.get_instance().get_watches(guild_id)
+
+    # Judge new tweets against the baseline with the same strategies as /scrape_best
+    def select_new_tweets(self, username, tweets, baseline, strategy):
+        user = User(TwitterScraper.get_instance().get_followers(username))
+        for rt_count, like_count, reply_count in zip(baseline["rt"], baseline["like"], baseline["reply"]):
+            user.add_metrics(rt_count, like_count, reply_count)
+        for tweet in tweets:
+            user.add_tweet(tweet)
+
+        return [tweet for tweet in tweet_stats.select(user, strategy) if tweet is not None]
+
+    async def poll(self, watch, num_watches):
+        guild_id, username, strategy, since_id, interval, _, baseline = watch
+        loop = asyncio.get_running_loop()
+        end_time = datetime.datetime.fromtimestamp(time.time() - self.settle_time, datetime.timezone.utc)
+
+        try:
+            async with JobManager.get_instance().fetch_slots:
+                tweets = await loop.run_in_executor(None, TwitterScraper.get_instance().get_new_tweets,
+                                                    username, since_id, end_time, POLL_COUNT)
+        except Exception as e:
+            Logger.get_instance().log(f"Failed to poll @{username}. Error: {e}", guild_id=guild_id)
+            tweets = None
+
+        if tweets is None or len(tweets) == 0:
+            # Nothing new, check back less often
+            interval = min(interval * 2, self.max_interval)
+            Database.get_instance().update_watch(guild_id, username, since_id, interval,
+                                                 self.get_next_poll(interval, num_watches), baseline)
+            return
+
+        selected = self.select_new_tweets(username, tweets, baseline, strategy)
+        Logger.get_instance().log(f"{len(selected)}/{len(tweets)} new tweets from @{username} met {strategy} criteria",
+                                  guild_id=guild_id)
+
+        tweets.reverse()
+        for key, column in (("rt", "rt_count"), ("like", "like_count"), ("reply", "reply_count")):
+            baseline[key] = (baseline[key] + [getattr(tweet, column) for tweet in tweets])[-BASELINE_SIZE:]
+
+        # Active account, check back sooner
+        interval = max(interval / 2, self.min_interval)
+        Database.get_instance().update_watch(guild_id, username, max(tweet.id for tweet in tweets), interval,
+                                             self.get_next_poll(interval, num_watches), baseline)
+
+        # Sends are paced, so posting can take minutes. Polls of the other accounts don't wait for it
+        if len(selected) > 0:
+            delivery = asyncio.create_task(self.deliver(guild_id, username, selected))
+            self.deliveries.add(delivery)
+            delivery.add_done_callback(self.deliveries.discard)
+
+    async def deliver(self, guild_id, username, tweets):
+        try:
+            await self.post(guild_id, username, tweets)
+        except Exception as e:
+            Logger.get_instance().log(f"Failed to post new tweets from @{username}. Error: {e}", guild_id=guild_id)
+
+    async def run(self):
+        Logger.get_instance().log("Started watching accounts")
+        while True:
+            watches = Database.get_instance().get_watches()
+            now = time.time()
+            for watch in watches:
+                if watch[5] > now:
+                    break
+
+                try:
+                    await self.poll(watch, len(watches))
+                except Exception as e:
+                    Logger.get_instance().log(f"Encountered error while polling @{watch[1]}. Error: {e}")
+
+            watches = Database.get_instance().get_watches()
+            sleep = Watcher.__max_sleep
+            if len(watches) > 0:
+                sleep = min(max(watches[0][5] - time.time(), 1), sleep)
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=sleep)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,61 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import tweet_stats
+
+# Stands in for a User inside a worker process. Only the metric columns are
+# sent over, and the "tweets" are their positions, so selection returns the
+# indices of the chosen tweets instead of pickling Tweet objects both ways
+class Columns:
+    def __init__(self, rt_counts, like_counts, reply_counts, followers):
+        self.tweets = range(len(rt_counts))
+        self.rt_counts = rt_counts
+        self.like_counts = like_counts
+        self.reply_counts = reply_counts
+        self.followers = followers
+
+def select_indices(rt_counts, like_counts, reply_counts, followers, strategy):
+    return tweet_stats.select(Columns(rt_counts, like_counts, reply_counts, followers), strategy)
+
+# Runs tweet selection in separate processes so ranking large timelines
+# doesn't hold the GIL while the event loop handles the gateway. Off unless
+# WORKER_PROCESSES is set, selection then stays on the default thread pool
+class WorkerPool:
+    __instance = None
+
+    def __init__(self):
+        if WorkerPool.__instance != None:
+            print("Tried to recreate instance")
+        else:
+            WorkerPool.__instance = self
+            self.size = int(os.environ.get('WORKER_PROCESSES', 0))
+            self.executor = None
+
+    def get_instance():
+        if WorkerPool.__instance is None:
+            WorkerPool()
+        return WorkerPool.__instance
+
+    def is_enabled(self):
+        return self.size > 0
+
+    def get_executor(self):
+        if self.executor is None:
+            # Forking a process that's running the Discord, Flask and logger threads isn't safe.
+            # Spawned workers re-run the launching script, which is why main.py only
+            # imports the bot when it's the program being run
+            self.executor = ProcessPoolExecutor(max_workers=self.size, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    # Returns the selected tweets of user
+    async def select(self, user, strategy):
+        strategy = tweet_stats.resolve_strategy(user, strategy)
+        loop = asyncio.get_running_loop()
+        indices = await loop.run_in_executor(self.get_executor(), select_indices, user.rt_counts, user.like_counts,
+                                             user.reply_counts, user.followers, strategy)
+        return [user.tweets[i] for i in indices]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)